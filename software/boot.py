@@ -51,12 +51,51 @@ if active_buttons >= 3:
 
 # Disable mass storage interface, so almost looks like a regular keypad.
 # But only when configured.
-if os.getenv('disable_usb_drive') or ('disable_usb_drive.txt' in os.listdir('/')):
+usb_drive_disabled = os.getenv('disable_usb_drive') or ('disable_usb_drive.txt' in os.listdir('/'))
+if usb_drive_disabled:
 	storage.disable_usb_drive()
 if os.getenv('lock_usb_drive') or ('lock_usb_drive.txt' in os.listdir('/')):
 	# make it read-write for CPY, so it'll become read-only for host because of the concurrent write protection
 	storage.remount('/', readonly=False)
 
+# N-key rollover keyboard, reports any number of keys held at once.
+# The boot keyboard stays the first keyboard device, lemon_keypad finds the NKRO one after it.
+if os.getenv('keyboard_nkro'):
+	NKRO_REPORT_DESCRIPTOR = bytes((
+		0x05, 0x01,  # Usage Page (Generic Desktop)
+		0x09, 0x06,  # Usage (Keyboard)
+		0xA1, 0x01,  # Collection (Application)
+		0x85, 0x04,  #   Report ID (4)
+		0x05, 0x07,  #   Usage Page (Keyboard)
+		0x15, 0x00,  #   Logical Minimum (0)
+		0x25, 0x01,  #   Logical Maximum (1)
+		0x75, 0x01,  #   Report Size (1)
+		0x19, 0xE0,  #   Usage Minimum (Left Control)
+		0x29, 0xE7,  #   Usage Maximum (Right GUI)
+		0x95, 0x08,  #   Report Count (8)
+		0x81, 0x02,  #   Input (Data, Variable, Absolute), modifiers
+		0x19, 0x00,  #   Usage Minimum (0)
+		0x29, 0x77,  #   Usage Maximum (0x77)
+		0x95, 0x78,  #   Report Count (120)
+		0x81, 0x02,  #   Input (Data, Variable, Absolute), key bitmap
+		0xC0,        # End Collection
+	))
+	nkro_keyboard = usb_hid.Device(
+		report_descriptor=NKRO_REPORT_DESCRIPTOR,
+		usage_page=0x01,
+		usage=0x06,
+		report_ids=(4,),
+		in_report_lengths=(16,),
+		out_report_lengths=(0,),
+	)
+	hid_devices = (usb_hid.Device.KEYBOARD, nkro_keyboard, usb_hid.Device.MOUSE, usb_hid.Device.CONSUMER_CONTROL)
+	# The boot protocol(e.g. BIOS) needs the boot keyboard on USB interface #0, that is only
+	# the case without the USB drive and the serial console, CircuitPython enters safe mode otherwise.
+	if usb_drive_disabled and os.getenv('disable_serial_console'):
+		usb_hid.enable(hid_devices, boot_device=1)
+	else:
+		usb_hid.enable(hid_devices)
+
 # Disable serial console. NOT RECOMMENDED FOR ROOKIES.
 # Read https://learn.adafruit.com/customizing-usb-devices-in-circuitpython/circuitpy-midi-serial#usb-serial-console-repl-and-data-3096590-12
 if os.getenv('disable_serial_console'):
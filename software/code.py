@@ -2,10 +2,10 @@ import board
 from busio import I2C
 
 from neopixel import NeoPixel
+from adafruit_lsm6ds import Rate
 from adafruit_lsm6ds.lsm6ds3trc import LSM6DS3TRC
+from lemon_keypad.lsm6ds import LSM6DSFIFO
 
-from adafruit_hid.consumer_control_code import ConsumerControlCode
-from adafruit_hid.keycode import Keycode
 
 
 # board consts
@@ -19,6 +19,10 @@ pixels = NeoPixel(PIXEL_PIN, 6)
 pixels.fill((0, 0, 0))
 i2c = I2C(I2C_SCL, I2C_SDA)
 imu = LSM6DS3TRC(i2c, 0x6a)
+imu.accelerometer_data_rate = Rate.RATE_208_HZ
+imu.gyro_data_rate = Rate.RATE_208_HZ
+# the samples are queued in the sensor's FIFO and read in bulk
+imu = LSM6DSFIFO(imu.i2c_device)
 
 # Pull code for lemon keypad
 from lemon_keypad import LemonKeypad
@@ -27,7 +31,11 @@ from lemon_keypad import ConsumerCode as CC
 from lemon_keypad import KeySequence as KS
 from lemon_keypad import KeyCombination as KC
 from lemon_keypad import TapDance as TD
-from lemon_keypad.keycode_helper import *
+# import the keys you use by name, keycode_helper.py lists all of them
+from lemon_keypad.keycodes import (
+    C_PLAY_PAUSE, C_SCAN_NEXT_TRACK, C_FAST_FORWARD, C_VOLUME_INCREMENT, C_MUTE,
+    C_VOLUME_DECREMENT, C_SCAN_PREVIOUS_TRACK, C_REWIND,
+)
 # from lemon_keypad.playground.level_gauge import level_gauge
 from lemon_keypad.playground.gyro_mouse import gyro_mouse
 
@@ -35,16 +43,29 @@ from lemon_keypad.playground.gyro_mouse import gyro_mouse
 keypad = LemonKeypad()
 keypad.keys = BUTTON_PINS
 keypad.key_active_value = False  # all pins are low active
+# keys wired in a matrix or read by shift registers work too, instead of `keys':
+# keypad.use_key_matrix(ROW_PINS, COLUMN_PINS)
+# keypad.use_shift_register_keys(clock=board.GP10, data=board.GP11, latch=board.GP12, key_count=16)
+# physical key number -> keymap index, None for unused positions
+# keypad.key_remap = (0, 1, 2, None, 3, 4, 5)
 keypad.imu = imu
+# the IMU is sampled at a fixed rate, only while a user function subscribes to keypad.imu_sampler
+# keypad.imu_rate_hz = 100
 keypad.pixels = pixels
+# LED effects draw on keypad.animator, which sends the pixels at most pixel_fps times per second
+# keypad.pixel_fps = 30
 
-# verbose logging
+# verbose logging, also prints where the startup time went once the HID interfaces are ready
 keypad.debug = True
 
 # well you CAN change the default keymap layer id
 # but make sure it exists
 #keypad.default_layer = 0
 
+# measure the heap use of key actions and user tasks
+# call keypad.print_memory_stats() (e.g. in a user function) to print them on the serial console
+#keypad.enable_memory_stats()
+
 # enable watchdog if you'd like to
 # MCU will reset itself if watchdog timed out
 #keypad.enable_watchdog()
@@ -3,7 +3,10 @@
 # 注2：缩进用Tab/制表符更省存储空间，这个文件里用的都是空格，每层缩进4个空格
 
 # 准备工作，从lib导入模块
-from lemon_keypad.keycode_helper import * # 导入键码，这样不用再重复手写数字了
+from lemon_keypad.keycodes import ( # 导入用到的键码，这样不用再重复手写数字了
+    C_PLAY_PAUSE, C_SCAN_NEXT_TRACK, C_FAST_FORWARD, C_VOLUME_INCREMENT, C_MUTE,
+    C_VOLUME_DECREMENT, C_SCAN_PREVIOUS_TRACK, C_REWIND, C_STOP,
+) # 只导入用到的键码更省内存，所有键码的名称在keycode_helper.py中可以查到
 from lemon_keypad import CompositeAction as Act # 导入复合按键工具，改名Act
 from lemon_keypad import TapDance as TD # 导入连击按键工具，改名TD
 from lemon_keypad import KeySequence as KS # 导入序列按键工具，改名KS
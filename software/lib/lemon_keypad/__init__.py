@@ -1,3 +1,16 @@
+import sys
+if sys.implementation.name != "circuitpython":
+	# running on a host, in the simulator: lemon_keypad_sim.install() has to come first
+	from lemon_keypad_sim import installed as _sim_installed, NativeTuple as _tuple
+	if not _sim_installed():
+		raise ImportError("lemon_keypad runs on CircuitPython, call lemon_keypad_sim.install() first to simulate it")
+else:
+	_tuple = tuple
+
+# started first, to time the imports below
+from .startup import StartupTimer
+_startup = StartupTimer()
+
 from micropython import const
 from microcontroller import Pin
 from microcontroller import watchdog as wdt
@@ -5,19 +18,18 @@ from watchdog import WatchDogMode
 import supervisor
 from supervisor import ticks_ms
 import gc
+from array import array
 
 import usb_hid
 import keypad
-from collections import namedtuple
 
 import asyncio
-from neopixel import NeoPixel
-
-
-from .hid_wrapper import Keyboard, Mouse, ConsumerControl
-from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
 
-import adafruit_logging as logging
+# optional subsystems (pixels, IMU, text layout, memory statistics) are imported when used
+from .hid_wrapper import Keyboard, NKROKeyboard, Mouse, ConsumerControl
+from .timer import DeadlineTimer, ticks_add, ticks_diff
+from .text import TextStreamer, compile_text, TEXT_QUEUE, TEXT_ABORT
+from . import log as logging
 
 try:
 	from typing import Sequence
@@ -28,6 +40,10 @@ except ImportError:
 logger = logging.getLogger("LemonKeypad")
 logger.setLevel(logging.WARNING)
 
+# guards the debug output of the key path, set by LemonKeypad.debug
+# even a disabled logger call builds its arguments, so check this first
+_debug = False
+
 # default values
 WDT_TIMEOUT = const(5) # seconds
 WDT_INTERVAL = const(2) # seconds
@@ -76,16 +92,22 @@ class AsyncEventQueue:
 	def __exit__(self, exc_type, exc_value, traceback):
 		pass
 
-	async def __await__(self):
-		await asyncio.core._io_queue.queue_read(self._events)
+	def __await__(self):
+		yield asyncio.core._io_queue.queue_read(self._events)
 		return self._events.get()
 
+	# MicroPython awaits objects through __iter__
+	__iter__ = __await__
+
 	def __aiter__(self):
 		return self
 
 	async def __anext__(self):
-		await asyncio.core._io_queue.queue_read(self._events)
-		return self._events.get()
+		return await self
+
+	async def get(self):
+		# a coroutine is required to wrap the wait in a task, e.g. for wait_for_ms
+		return await self
 
 
 class CompositeAction:
@@ -125,7 +147,7 @@ class Delay:
 class ConsumerCode(int): pass
 class MouseCode(int): pass
 
-class KeyTuple(tuple):
+class KeyTuple(_tuple):
 	def __init__(self, *args, delay=0) -> None:
 		super().__init__(args)
 		self.delay = delay
@@ -133,27 +155,110 @@ class KeyTuple(tuple):
 class KeySequence(KeyTuple): pass
 class KeyCombination(KeyTuple): pass
 
-class TapDance(tuple):
+class TapDance(_tuple):
 	def __init__(self, *args, tap_term_ms: int = 200):
 		super().__init__(args)
 		self.tap_term_ms = tap_term_ms
 
-# This is used internally, users should ONLY use CompositeAction for complex actions
-LayerAction = namedtuple("LayerAction", ["layer", "action"])
+class Transparent:
+	# keymap marker, the key does what it does in the next active layer below
+	def __repr__(self) -> str:
+		return 'TRANSPARENT'
+
+TRANSPARENT = Transparent()
+
+
+# Compiled action kinds
+# The keymap is compiled once into (kind, payload) tuples, see LemonKeypad.compile_action
+_ACT_NONE = const(0)
+_ACT_KEY = const(1)  # payload: keycode
+_ACT_CONSUMER = const(2)  # payload: consumer control code
+_ACT_MOUSE = const(3)  # payload: mouse buttons
+_ACT_TEXT = const(4)  # payload: (modifier, keycode) pairs, see compile_text
+_ACT_FUNCTION = const(5)  # payload: callable
+_ACT_SEQUENCE = const(6)  # payload: macro, see compile_macro
+_ACT_COMBINATION = const(7)  # payload: macro, see compile_macro
+_ACT_DELAY = const(8)  # payload: seconds
+_ACT_LAYER = const(9)  # payload: (layer id, compiled action), used internally for layer+hold
+_ACT_COMPOSITE = const(10)  # payload: CompiledCompositeAction
+_ACT_TAP_DANCE = const(11)  # payload: (compiled actions, tap_term_ms)
+_ACT_TRANSPARENT = const(12)  # only in compiled layers, never triggered
+
+# by kind, for the memory statistics
+_ACT_NAMES = ("none", "key", "consumer", "mouse", "text", "function", "sequence", "combination", "delay", "layer", "composite", "tap_dance", "transparent")
+
+NO_ACTION = (_ACT_NONE, None)
+_TRANSPARENT_ACTION = (_ACT_TRANSPARENT, None)
+
+# Macro ops
+# KeySequence and KeyCombination are compiled into a macro, (program, constants):
+# the program is a flat run of 3 byte ops, the opcode then a 16 bit little endian
+# argument. Nested ones are inlined, so running a macro never recurses.
+# Each press, release, tap triple is in this order, see emit_macro_step
+_OP_PRESS = const(0)  # keycode
+_OP_RELEASE = const(1)  # keycode
+_OP_TAP = const(2)  # keycode
+_OP_CONSUMER_PRESS = const(3)  # consumer control code
+_OP_CONSUMER_RELEASE = const(4)  # consumer control code, ignored: only one code is pressed at a time
+_OP_CONSUMER_TAP = const(5)  # consumer control code
+_OP_MOUSE_PRESS = const(6)  # mouse buttons
+_OP_MOUSE_RELEASE = const(7)  # mouse buttons
+_OP_MOUSE_TAP = const(8)  # mouse buttons
+_OP_DELAY = const(9)  # milliseconds
+_OP_TEXT = const(10)  # index of the compiled text in the constants
+_OP_CALL = const(11)  # index of the compiled function action in the constants
+
+
+def _emit(program: bytearray, op: int, arg: int) -> None:
+	if not 0 <= arg <= 0xFFFF:
+		raise ValueError("macro argument out of range: %s" % (arg,))
+	program.append(op)
+	program.append(arg & 0xFF)
+	program.append(arg >> 8)
+
+
+def _emit_delay(program: bytearray, seconds: float) -> None:
+	if seconds <= 0:
+		return
+	# at least 1 ms, a delay always lets the other tasks run
+	ms = max(1, int(seconds * 1000 + 0.5))
+	while ms > 0:
+		_emit(program, _OP_DELAY, min(ms, 0xFFFF))
+		ms -= 0xFFFF
+
+# key_remap entry of a physical key without logical key
+_NO_KEY = const(0xFF)
+
+
+class CompiledCompositeAction:
+	# CompositeAction with all sub-actions compiled and the layer resolved to its id
+	def __init__(self, action: CompositeAction, tap, hold, layer_hold, long_hold) -> None:
+		self.tap = tap
+		self.hold = hold
+		self.layer_hold = layer_hold  # the hold action together with the layer switch
+		self.long_hold = long_hold
+		self.tap_term_ms = action.tap_term_ms
+		self.hold_term_ms = action.hold_term_ms
+		self.long_hold_start_ms = action.long_hold_start_ms
+		self.tap_preferred = action.tap_preferred
 
 
 class LemonKeypad:
 	def __init__(self) -> None:
 		# the objects to interact with the HID interface
 		self.keyboard = None
-		self.keyboard_layout = None  # keyboard with layout, provide an easy way to send text
+		self.keyboard_layout = None  # keyboard with layout, provide an easy way to send text, created by send_text
 		self.mouse = None
 		self.consumer_control = None
 
 		# the resources are decoupled, it's user's duty to initialize most hardwares
 		self._imu = None  # inertial sensor, provides property interfaces: gyro, acceleration
+		self.imu_sampler = None  # shared IMU samples, created by imu_data_processor
 		self._pixels = None  # neopixel object
+		self.animator = None  # draws on the pixels, created by pixel_animation_control
 		self._keys = None  # a list of gpios in the order of key numbers
+		self._key_remap = None  # physical key number -> logical key index, see key_remap
+		self.key_count = 0  # logical key count, known after the key scanner is set up
 		self._key_active_value = True  # the active value of the keys, also indicate the pull direction
 		self._default_layer = 0
 
@@ -163,13 +268,60 @@ class LemonKeypad:
 
 		# internal shared states
 		self.key_scanner = None
-		self.undetermined_key_index = -1
-		self.undetermined_key_timestamp = 0
-		self.undetermined_key_action = None
-		self.undetermined_tap_dance_action_index = 0
-		self.undetermined_tap_dance_pressed = False
+		self.pending_keys = None  # keys whose action isn't decided yet, see setup_env_key_event_processer
+		self.deadline_timer = None  # fires pending actions when their terms expire
 		self.key_actions = None  # currently triggered key actions
-		self.layer_tracker = None
+
+		# layer states, by layer id
+		# the held layers are a doubly linked list in activation order, the last activated on top
+		self.layer_refcounts = None  # how many keys hold each layer active
+		self.layer_below = None  # the held layer activated before each held layer, -1 if none
+		self.layer_above = None  # the held layer activated after each held layer, -1 if none
+		self.top_layer = -1  # the last activated layer still held, -1 if none
+		self.base_layer = 0  # the default layer
+		self.active_layer = 0  # the layer on top
+		self.effective_actions = None  # per key, the action in the active layers, see update_effective_actions
+
+		# compiled keymap
+		self.layers = None  # per layer id, the compiled actions of all keys
+		self.layer_ids = None  # layer name -> layer id
+		self.layer_names = None  # layer id -> layer name
+
+		# sleep on the key event queue instead of polling it
+		# the processer wakes up on key events or the pending actions' deadlines
+		self.event_driven = True
+
+		# how long key events waited in the queue before being processed
+		# the timing decisions use the scan timestamps, but a long wait still delays the output
+		self.queue_delay_warning_ms = 100  # log a warning when an event waited longer
+		self.reset_queue_delay_stats()
+
+		# coalesce the HID reports produced in one scan tick
+		# at most one report per interface is sent, unless a macro needs several
+		self.batch_hid_reports = True
+		self.hid_batch_active = False
+
+		# use the N-key rollover keyboard when boot.py registered it
+		# the boot keyboard is still used when the host asks for the boot protocol, e.g. BIOS
+		self.keyboard_nkro = True
+
+		# strings in the keymap are typed in the background
+		self.text_rate_cps = 0  # characters per second, 0 for as fast as possible
+		self.text_mode = TEXT_QUEUE  # what a key pressed meanwhile does, TEXT_QUEUE or TEXT_ABORT
+		self.text_streamer = None
+
+		# the IMU is sampled at a fixed rate while any consumer is subscribed to imu_sampler
+		self.imu_rate_hz = 100
+		self.imu_buffer_size = 32  # samples kept for windowed reads
+
+		# LED effects are rendered at a fixed frame rate, pixels are only sent when they change
+		self.pixel_fps = 30
+
+		# heap statistics, see enable_memory_stats
+		self.memory_stats = None
+
+		# when the startup phases ended, see print_startup_report
+		self.startup = _startup
 
 		# extra async tasks
 		# must be corroutine functions(functions that create coroutines, i.e. async def)
@@ -192,7 +344,8 @@ class LemonKeypad:
 
 	@pixels.setter
 	def pixels(self, value):
-		if isinstance(value, NeoPixel):
+		# checked by its interface, neopixel is imported by the user anyway
+		if hasattr(value, 'n') and hasattr(value, 'show') and hasattr(value, 'auto_write'):
 			self._pixels = value
 		else:
 			raise ValueError('The pixels object must be a NeoPixel object')
@@ -213,6 +366,34 @@ class LemonKeypad:
 
 		raise ValueError('The keys object must be a non-empty list of Pin objects')
 
+	@property
+	def key_remap(self):
+		return self._key_remap
+
+	@key_remap.setter
+	def key_remap(self, value):
+		# value[physical key number] is the logical key index, or None if the key is not used
+		remap = bytearray(len(value))
+		for i, key_index in enumerate(value):
+			if key_index is None:
+				remap[i] = _NO_KEY
+			elif 0 <= key_index < _NO_KEY:
+				remap[i] = key_index
+			else:
+				raise ValueError('key_remap entries must be None or between 0 and %d' % (_NO_KEY - 1))
+		self._key_remap = remap
+
+	def use_key_matrix(self, row_pins: Sequence[Pin], column_pins: Sequence[Pin], *, columns_to_anodes: bool = True) -> None:
+		# keys wired in rows and columns, physical key number is row * len(column_pins) + column
+		self.key_scanner = keypad.KeyMatrix(row_pins, column_pins, columns_to_anodes=columns_to_anodes)
+
+	def use_shift_register_keys(self, *, clock: Pin, data: Pin, latch: Pin, key_count: int, value_to_latch: bool = True) -> None:
+		# keys read through parallel-in serial-out shift registers, e.g. 74HC165
+		self.key_scanner = keypad.ShiftRegisterKeys(
+			clock=clock, data=data, latch=latch, key_count=key_count,
+			value_to_latch=value_to_latch, value_when_pressed=self.key_active_value,
+		)
+
 	@property
 	def key_active_value(self):
 		return self._key_active_value
@@ -226,10 +407,12 @@ class LemonKeypad:
 
 	@property
 	def debug(self):
-		return logger.getEffectiveLevel <= logging.DEBUG
+		return _debug
 
 	@debug.setter
 	def debug(self, value: bool):
+		global _debug
+		_debug = bool(value)
 		if value:
 			logger.setLevel(logging.DEBUG)
 		else:
@@ -237,16 +420,20 @@ class LemonKeypad:
 
 	@property
 	def default_layer(self):
-		if self.layer_tracker is not None and len(self.layer_tracker) > 0:
-			return self.layer_tracker[0]
-		else:
-			return self._default_layer
+		return self._default_layer
 
 	@default_layer.setter
 	def default_layer(self, value):
+		if self.layer_ids is not None:
+			# keymap already compiled
+			if value not in self.layer_ids:
+				raise ValueError("default layer(`%s') must be defined in keymap" % (value,))
+			self.base_layer = self.layer_ids[value]
+			if self.top_layer < 0:
+				self.active_layer = self.base_layer
+			if self.effective_actions is not None:
+				self.update_effective_actions()
 		self._default_layer = value
-		if self.layer_tracker is not None and len(self.layer_tracker) > 0:
-			self.layer_tracker[0] = value
 
 	### Entry ###
 
@@ -254,13 +441,14 @@ class LemonKeypad:
 		asyncio.run(self.run_async())
 
 	async def run_async(self) -> None:
+		self.startup.mark("configured")
 		# create an event loop and run all tasks
 		tasks = [
 			asyncio.create_task(self.watchdog_feeder()),
 			asyncio.create_task(self.load_hid_devices()),
 		]
 
-		if self.keys is not None:
+		if self.keys is not None or self.key_scanner is not None:
 			logger.info("Enable key event processing")
 			tasks.append(asyncio.create_task(self.key_event_processer()))
 		if self.imu is not None:
@@ -273,7 +461,10 @@ class LemonKeypad:
 		if self.user_tasks is not None:
 			logger.info("Enable %d user defined tasks", len(self.user_tasks))
 			for task in self.user_tasks:
-				tasks.append(asyncio.create_task(task()))
+				coro = task()
+				if self.memory_stats is not None:
+					coro = self.memory_stats.measure_task(task.__name__, coro)
+				tasks.append(asyncio.create_task(coro))
 
 		await asyncio.gather(*tasks)
 
@@ -288,32 +479,120 @@ class LemonKeypad:
 
 		self.setup_env_key_event_processer()
 		event_queue = self.key_scanner.events
+		key_remap = self._key_remap
+		async_event_queue = AsyncEventQueue(event_queue) if self.event_driven else None
 
 		while True:
-			await asyncio.sleep(0)  # switch task
+			if async_event_queue is None:
+				await asyncio.sleep(0)  # switch task
+				new_event = event_queue.get()
+			else:
+				new_event = await self.wait_key_event(async_event_queue)
 
-			new_event = event_queue.get()
-			current_timestamp = ticks_ms()
+			self.begin_hid_batch()
+			while True:
+				if new_event is None:
+					# fire the pending actions whose deadline has passed
+					await self.process_deadlines(ticks_ms())
+					break
 
-			if new_event is None:
-				await self.process_undetermined_action(current_timestamp)
-				continue
+				# time decisions on when the key was scanned, not when the event is processed
+				current_timestamp = new_event.timestamp
+				self.record_queue_delay(ticks_diff(ticks_ms(), current_timestamp))
 
-			logger.debug("KEY EVENT: index %d, %s", new_event.key_number, 'Pressed' if new_event.pressed else 'Released')
+				# deadlines which passed before this event go first
+				await self.process_deadlines(current_timestamp)
 
-			if new_event.pressed:
-				await self.process_undetermined_action(current_timestamp, new_press_index=new_event.key_number)
-			else:
-				await self.process_undetermined_action(current_timestamp)
-			await self.process_new_key_event(new_event.key_number, new_event.pressed, current_timestamp)
+				if _debug:
+					logger.debug("KEY EVENT: index %d, %s", new_event.key_number, 'Pressed' if new_event.pressed else 'Released')
 
-	async def imu_data_processor(self):
+				key_index = new_event.key_number
+				if key_remap is not None:
+					key_index = key_remap[key_index]
+				# without a remap every key number is a key, 0xFF included
+				if key_remap is None or key_index != _NO_KEY:
+					if new_event.pressed and self.text_streamer.busy():
+						await self.interrupt_text()
+
+					await self.process_new_key_event(key_index, new_event.pressed, current_timestamp)
+
+				# events arrived in the meantime go into the same batch
+				new_event = event_queue.get()
+			self.end_hid_batch()
+
+	async def wait_key_event(self, async_event_queue):
+		# return the next key event, or None when a pending action needs a re-check
+		new_event = async_event_queue._events.get()
+		if new_event is not None:
+			return new_event
+
+		deadline = self.deadline_timer.next_deadline()
+		if deadline is None:
+			# nothing pending, sleep until a key event arrives
+			return await async_event_queue
+
+		timeout = ticks_diff(deadline, ticks_ms())
+		if timeout <= 0:
+			await asyncio.sleep(0)  # switch task
+			return None
+		try:
+			return await asyncio.wait_for_ms(async_event_queue.get(), timeout)
+		except asyncio.TimeoutError:
+			# an event scanned before the deadline may have arrived meanwhile
+			return async_event_queue._events.get()
+
+	def record_queue_delay(self, delay_ms) -> None:
+		self.queue_delay_count += 1
+		self.queue_delay_total_ms += delay_ms
+		if delay_ms > self.queue_delay_max_ms:
+			self.queue_delay_max_ms = delay_ms
+		if delay_ms > self.queue_delay_warning_ms:
+			logger.warning("Key event waited %d ms in the queue", delay_ms)
+
+	def reset_queue_delay_stats(self) -> None:
+		self.queue_delay_count = 0
+		self.queue_delay_total_ms = 0
+		self.queue_delay_max_ms = 0
+
+	def queue_delay_stats(self) -> tuple:
+		# (event count, average delay, maximum delay), delays in ms
+		if self.queue_delay_count == 0:
+			return (0, 0, 0)
+		return (self.queue_delay_count, self.queue_delay_total_ms / self.queue_delay_count, self.queue_delay_max_ms)
+
+	async def interrupt_text(self) -> None:
+		# a key is pressed while a string is being typed
+		if self.text_mode == TEXT_ABORT:
+			if _debug:
+				logger.debug("Aborting text output")
+			self.text_streamer.abort()
+		else:
+			batching = self.end_hid_batch()
+			await self.text_streamer.wait()
+			if batching:
+				self.begin_hid_batch()
+
+	async def process_deadlines(self, current_timestamp) -> None:
+		timer = self.deadline_timer
 		while True:
-			await asyncio.sleep(1)  # switch task
+			deadline = timer.next_deadline()
+			if deadline is None or ticks_diff(deadline, current_timestamp) > 0:
+				return
+			key_index = timer.pop_due(current_timestamp)
+			if self.pending_actions[key_index] is not NO_ACTION:
+				# decide as if it was processed right at the deadline
+				await self.resolve_pending_before(key_index, deadline)
+				await self.process_pending_key(key_index, deadline)
+
+	async def imu_data_processor(self):
+		from .imu import IMUSampler  # ulab is only needed with an IMU
+		self.imu_sampler = IMUSampler(self.imu, self.imu_rate_hz, self.imu_buffer_size)
+		await self.imu_sampler.run()
 
 	async def pixel_animation_control(self):
-		while True:
-			await asyncio.sleep(1)  # switch task
+		from .animation import PixelAnimator
+		self.animator = PixelAnimator(self.pixels, self.pixel_fps)
+		await self.animator.run()
 
 	async def load_hid_devices(self):
 		while True:
@@ -334,18 +613,22 @@ class LemonKeypad:
 			if not self.load_keyboard() or not self.load_mouse() or not self.load_consumer_control():
 				# break to parent loop and re-enumerate
 				break
+			if "HID ready" not in self.startup.phases:
+				self.startup.mark("HID ready")
+				if _debug:
+					self.print_startup_report()
 
 	### Internal APIs ###
 
 	def verify_keymap(self) -> None:
 		if not isinstance(self.keymap, dict):
 			raise ValueError('keymap must be a dict')
-		key_count = len(self.keys)
+		key_count = self.key_count
 		for k, v in self.keymap.items():
 			if not isinstance(v, list) and not isinstance(v, tuple):
 				raise ValueError('keymap layers must be a list or tuple, however layer %s is not' % (k,))
-			if len(v) != key_count:
-				raise ValueError('keymap layers must strictly define %d key actions, however layer %s is not' % (key_count, k))
+			if len(v) > key_count:
+				raise ValueError('keymap layers must define at most %d key actions, however layer %s defines %d' % (key_count, k, len(v)))
 		if self.default_layer not in self.keymap.keys():
 			raise ValueError("default layer(which now is `%s') must be defined in keymap" % (self.default_layer,))
 
@@ -357,271 +640,590 @@ class LemonKeypad:
 				self.default_layer: ('1', '2', '3', '4', '5', '6')
 			}
 
-		self.verify_keymap()
-
-		# initialize key_scanner
+		# initialize key_scanner, direct wired keys unless a matrix or shift register is used
 		if self.key_scanner is None:
 			self.key_scanner = keypad.Keys(self.keys, value_when_pressed=self.key_active_value, pull=True)
 
+		# everything below is indexed by logical key index
+		if self._key_remap is None:
+			key_count = self.key_scanner.key_count
+		else:
+			if len(self._key_remap) != self.key_scanner.key_count:
+				raise ValueError('key_remap must map all %d physical keys' % self.key_scanner.key_count)
+			key_count = 0
+			for key_index in self._key_remap:
+				if key_index != _NO_KEY and key_index >= key_count:
+					key_count = key_index + 1
+		self.key_count = key_count
+
+		self.verify_keymap()
+		self.compile_keymap()
+		self.startup.mark("keymap compiled")
+
 		# initialize/reset key_actions
-		if self.key_actions is None:
-			self.key_actions = [None] * self.key_scanner.key_count
+		if self.key_actions is None or len(self.key_actions) != key_count:
+			self.key_actions = [NO_ACTION] * key_count
+		else:
+			for i in range(key_count):
+				self.key_actions[i] = NO_ACTION
+
+		# initialize/reset layer states
+		self.layer_refcounts = bytearray(len(self.layers))
+		self.layer_below = array("h", [-1] * len(self.layers))
+		self.layer_above = array("h", [-1] * len(self.layers))
+		self.effective_actions = [NO_ACTION] * key_count
+		self.reset_layers()
+
+		# Keys with a CompositeAction or TapDance stay pending until their action is decided
+		# every key has its own pending state, several keys can be pending at once
+		self.pending_keys = []  # pending key indexes, in press order
+		self.pending_actions = [NO_ACTION] * key_count  # NO_ACTION if the key is not pending
+		self.pending_timestamps = array("l", [0] * key_count)  # last press
+		self.pending_taps = bytearray(key_count)  # TapDance action index
+		self.pending_pressed = bytearray(key_count)
+
+		if self.text_streamer is None:
+			self.text_streamer = TextStreamer(self)
 		else:
-			for i in range(len(self.key_actions)):
-				self.key_actions[i] = None
+			self.text_streamer.abort()
 
-		# initialize/reset layer_tracker
-		if self.layer_tracker is None:
-			self.layer_tracker = [0] * self.key_scanner.key_count
-		self.layer_tracker.clear()
-		self.layer_tracker.append(self.default_layer)
+		# initialize/reset deadline_timer
+		if self.deadline_timer is None or len(self.deadline_timer.deadlines) != key_count:
+			self.deadline_timer = DeadlineTimer(key_count)
+		else:
+			self.deadline_timer.clear()
+
+	def compile_keymap(self) -> None:
+		# resolve layer names to ids and compile every key action once
+		# the default layer is always compiled as id 0, followed by integer names in
+		# ascending order, then string names in alphabetical order. The ids must not
+		# depend on the dict order, which is arbitrary on CircuitPython.
+		# When several layers are active, the last activated one wins, see push_layer.
+		int_names = []
+		str_names = []
+		other_names = []
+		for name in self.keymap.keys():
+			if name == self.default_layer:
+				continue
+			elif isinstance(name, int):
+				int_names.append(name)
+			elif isinstance(name, str):
+				str_names.append(name)
+			else:
+				other_names.append(name)
+		int_names.sort()
+		str_names.sort()
+		self.layer_names = [self.default_layer] + int_names + str_names + other_names
+		self.layer_ids = {}
+		for layer_id, name in enumerate(self.layer_names):
+			self.layer_ids[name] = layer_id
+		# keys missing at the end of a layer are transparent
+		self.layers = [
+			tuple(
+				_TRANSPARENT_ACTION if action is TRANSPARENT else self.compile_action(action)
+				for action in self.keymap[name]
+			)
+			for name in self.layer_names
+		]
 
-		# There's only one undetermined key at most
-		# The undetermined key has a special action defined by `Action' class
-		self.undetermined_key_index = -1
-		self.undetermined_key_timestamp = 0
+	def compile_action(self, action) -> tuple:
+		# compile a raw keymap action into a (kind, payload) tuple
+		if action is None:
+			return NO_ACTION
+		elif isinstance(action, CompositeAction):
+			tap = self.compile_action(action.tap)
+			hold = self.compile_action(action.hold)
+			if action.layer is None:
+				layer_hold = hold
+			elif action.layer in self.layer_ids:
+				layer_hold = (_ACT_LAYER, (self.layer_ids[action.layer], hold))
+			else:
+				raise ValueError("layer `%s' used by a CompositeAction must be defined in keymap" % (action.layer,))
+			long_hold = self.compile_action(action.long_hold)
+			return (_ACT_COMPOSITE, CompiledCompositeAction(action, tap, hold, layer_hold, long_hold))
+		elif isinstance(action, TapDance):
+			return (_ACT_TAP_DANCE, (tuple(self.compile_action(act) for act in action), action.tap_term_ms))
+		elif isinstance(action, KeySequence):
+			return (_ACT_SEQUENCE, self.compile_macro(action))
+		elif isinstance(action, KeyCombination):
+			return (_ACT_COMBINATION, self.compile_macro(action))
+		elif isinstance(action, Delay):
+			return (_ACT_DELAY, action.delay)
+		elif isinstance(action, str):
+			return (_ACT_TEXT, compile_text(action))
+		elif isinstance(action, ConsumerCode):
+			return (_ACT_CONSUMER, int(action))
+		elif isinstance(action, MouseCode):
+			return (_ACT_MOUSE, int(action))
+		elif isinstance(action, int):
+			return (_ACT_KEY, action)
+		elif callable(action):
+			return (_ACT_FUNCTION, action)
+		raise ValueError("unsupported key action: %s/%s" % (action.__class__.__name__, action))
+
+	def compile_macro(self, action: KeyTuple) -> tuple:
+		# compile a KeySequence or KeyCombination into a (program, constants) macro
+		program = bytearray()
+		constants = []
+		self.emit_macro(program, constants, action)
+		return (bytes(program), tuple(constants))
+
+	def emit_macro(self, program: bytearray, constants: list, action: KeyTuple) -> None:
+		# a sequence taps each action and waits after it, a combination presses all
+		# of them, waits, then releases all of them in the same order
+		if isinstance(action, KeySequence):
+			for act in action:
+				self.emit_macro_step(program, constants, act, _OP_TAP)
+				_emit_delay(program, action.delay)
+		else:
+			for act in action:
+				self.emit_macro_step(program, constants, act, _OP_PRESS)
+			_emit_delay(program, action.delay)
+			for act in action:
+				self.emit_macro_step(program, constants, act, _OP_RELEASE)
+
+	def emit_macro_step(self, program: bytearray, constants: list, act, step: int) -> None:
+		# step: _OP_PRESS, _OP_RELEASE or _OP_TAP
+		# nested macros, delays, text and functions run completely when pressed
+		if act is None:
+			return
+		elif isinstance(act, KeyTuple):
+			if step != _OP_RELEASE:
+				self.emit_macro(program, constants, act)
+		elif isinstance(act, Delay):
+			if step != _OP_RELEASE:
+				_emit_delay(program, act.delay)
+		elif isinstance(act, str):
+			if step != _OP_RELEASE:
+				_emit(program, _OP_TEXT, len(constants))
+				constants.append(compile_text(act))
+		elif isinstance(act, ConsumerCode):
+			_emit(program, _OP_CONSUMER_PRESS + step, act)
+		elif isinstance(act, MouseCode):
+			_emit(program, _OP_MOUSE_PRESS + step, act)
+		elif isinstance(act, int):
+			_emit(program, step, act)
+		else:
+			# pending actions (CompositeAction, TapDance) do nothing in a macro
+			compiled = self.compile_action(act)
+			if compiled[0] == _ACT_FUNCTION and step != _OP_RELEASE:
+				_emit(program, _OP_CALL, len(constants))
+				constants.append(compiled)
 
 	async def process_new_key_event(self, key_index, pressed, current_timestamp) -> None:
-		logger.debug("Layer tracker: %s", self.layer_tracker)
-		current_layer = self.layer_tracker[-1]
-		action = self.keymap[current_layer][key_index]
 		if pressed:
-			if isinstance(action, CompositeAction):
-				logger.debug("CompositeAction pending")
-				self.undetermined_key_index = key_index
-				self.undetermined_key_timestamp = current_timestamp
-				self.undetermined_key_action = action
-			elif isinstance(action, TapDance):
-				if self.undetermined_key_index == key_index:
-					self.undetermined_tap_dance_action_index += 1
-					logger.debug("TapDance pending and index increased to %d", self.undetermined_tap_dance_action_index)
-					if len(action) <= self.undetermined_tap_dance_action_index:
-						logger.debug("TapDance limit reached, trigger last keycode")
-						await self.trigger_key_action(key_index, pressed, action[-1])
-						self.undetermined_key_index = -1
-				else:
-					logger.debug("TapDance pending, this is first tap")
-					self.undetermined_key_index = key_index
-					self.undetermined_key_action = action
-					self.undetermined_tap_dance_action_index = 0
-				self.undetermined_key_timestamp = current_timestamp
-				self.undetermined_tap_dance_pressed = True
+			if self.pending_actions[key_index] is not NO_ACTION:
+				# only a TapDance key is still pending when pressed again
+				await self.process_tap_dance_press(key_index, current_timestamp)
+				return
+
+			# decide the pending keys which can't wait past this press, they may switch layers
+			await self.resolve_pending_for_press(current_timestamp)
+
+			action = self.effective_actions[key_index]
+			kind = action[0]
+			if kind == _ACT_COMPOSITE or kind == _ACT_TAP_DANCE:
+				if _debug:
+					logger.debug("key %d pending", key_index)
+				self.pending_keys.append(key_index)
+				self.pending_actions[key_index] = action
+				self.pending_timestamps[key_index] = current_timestamp
+				self.pending_taps[key_index] = 0
+				self.pending_pressed[key_index] = 1
+				self.arm_pending_deadline(key_index)
 			else:
-				logger.debug("trigger key %d's action directly", key_index)
+				# an immediate action, everything pressed before it goes first
+				await self.resolve_pending_before(-1, current_timestamp)
+				if _debug:
+					logger.debug("trigger key %d's action directly", key_index)
 				await self.trigger_key_action(key_index, pressed, action)
 		else:
-			logger.debug("releasing key %d", key_index)
-			if self.undetermined_key_index == key_index:
-				if isinstance(self.undetermined_key_action, CompositeAction):
-					logger.debug("trigger CompositeAction")
-					await self.process_undetermined_action(current_timestamp, pressed=pressed)
-				if isinstance(self.undetermined_key_action, TapDance):
-					logger.debug("TapDance released")
-					self.undetermined_tap_dance_pressed = False
-					await self.process_undetermined_action(current_timestamp, pressed=pressed)
-			else:
+			if _debug:
+				logger.debug("releasing key %d", key_index)
+			pending_action = self.pending_actions[key_index]
+			if pending_action is NO_ACTION:
 				await self.trigger_key_action(key_index, pressed)
+			elif pending_action[0] == _ACT_COMPOSITE:
+				# decided by this release, after the keys pressed before it
+				await self.resolve_pending_before(key_index, current_timestamp)
+				await self.process_pending_key(key_index, current_timestamp, pressed=False)
+			else:
+				if _debug:
+					logger.debug("TapDance released")
+				self.pending_pressed[key_index] = 0
+
+	async def process_tap_dance_press(self, key_index, current_timestamp) -> None:
+		taps = self.pending_taps[key_index] + 1
+		if _debug:
+			logger.debug("TapDance pending and index increased to %d", taps)
+		tap_dance_actions = self.pending_actions[key_index][1][0]
+		if len(tap_dance_actions) <= taps:
+			if _debug:
+				logger.debug("TapDance limit reached, trigger last keycode")
+			await self.resolve_pending_before(key_index, current_timestamp)
+			await self.trigger_key_action(key_index, True, tap_dance_actions[-1])
+			self.clear_pending_key(key_index)
+			return
+		self.pending_taps[key_index] = taps
+		self.pending_timestamps[key_index] = current_timestamp
+		self.pending_pressed[key_index] = 1
+		self.arm_pending_deadline(key_index)
+
+	async def resolve_pending_for_press(self, current_timestamp) -> None:
+		# A TapDance is over once another key is pressed, and a key which may
+		# switch layers decides how the new key is looked up. Both are decided
+		# now, together with every key pressed before them.
+		pending_keys = self.pending_keys
+		pending_actions = self.pending_actions
+		count = 0
+		for i in range(len(pending_keys)):
+			kind, action = pending_actions[pending_keys[i]]
+			if kind == _ACT_TAP_DANCE or action.layer_hold[0] == _ACT_LAYER:
+				count = i + 1
+		for _ in range(count):
+			if not pending_keys:
+				break  # forgotten by a user function
+			await self.process_pending_key(pending_keys[0], current_timestamp, interrupted=True)
+
+	async def resolve_pending_before(self, key_index, current_timestamp) -> None:
+		# decide the keys pressed before `key_index' (all of them if -1), in press order
+		pending_keys = self.pending_keys
+		while pending_keys and pending_keys[0] != key_index:
+			await self.process_pending_key(pending_keys[0], current_timestamp, interrupted=True)
+
+	def arm_pending_deadline(self, key_index) -> None:
+		deadline = self.get_pending_deadline(key_index)
+		if deadline is not None:
+			self.deadline_timer.arm(key_index, deadline)
+
+	def clear_pending_key(self, key_index) -> None:
+		if self.pending_actions[key_index] is NO_ACTION:
+			return  # already forgotten by reset_key_actions
+		self.deadline_timer.cancel(key_index)
+		self.pending_actions[key_index] = NO_ACTION
+		# pending keys stay in press order, removing one walks the few of them
+		self.pending_keys.remove(key_index)
+
+	def get_pending_deadline(self, key_index):
+		# the ticks_ms timestamp when the pending key resolves by timeout, None if no deadline
+		kind, action = self.pending_actions[key_index]
+		timestamp = self.pending_timestamps[key_index]
+		if kind == _ACT_COMPOSITE:
+			if action.long_hold is NO_ACTION:
+				return ticks_add(timestamp, action.tap_term_ms + 1)
+			return ticks_add(timestamp, action.long_hold_start_ms + 1)
+		elif kind == _ACT_TAP_DANCE:
+			return ticks_add(timestamp, action[1] + 1)
+		return None
 
-	async def process_undetermined_action(self, current_timestamp, *, new_press_index=-1, pressed=True) -> None:
-		# this function maintain the following internal states:
-		# - undetermined_key_index
-		# - undetermined_key_layer
-		if self.undetermined_key_index < 0:
-			return  # no undetermined action
-		action = self.undetermined_key_action
-		time_delta = current_timestamp - self.undetermined_key_timestamp
-		if isinstance(action, CompositeAction):
-			if new_press_index >= 0:
-				# it's determined by a new key press
+	async def process_pending_key(self, key_index, current_timestamp, *, interrupted=False, pressed=True) -> None:
+		# decide a pending key's action
+		# - interrupted: another key needs this key decided first, always decides
+		# - not pressed: the key is released
+		# - otherwise: a regular check against the terms
+		kind, action = self.pending_actions[key_index]
+		time_delta = ticks_diff(current_timestamp, self.pending_timestamps[key_index])
+		if kind == _ACT_COMPOSITE:
+			if interrupted:
 				if (time_delta < action.tap_term_ms
-						and action.tap is not None
+						and action.tap is not NO_ACTION
 						and action.tap_preferred):
 					# trigger tap action if defined and preferred
-					logger.debug("trigger CompositeAction tap")
-					await self.trigger_key_action(self.undetermined_key_index, pressed, action.tap)
-					self.undetermined_key_index = -1
+					if _debug:
+						logger.debug("trigger CompositeAction tap")
+					await self.trigger_key_action(key_index, True, action.tap)
 				elif time_delta < action.hold_term_ms:
 					# switch layer and activate layer+hold action if they are defined
 					# trigger hold action if layer is not defined
 					# layer change only happens HERE and it's on-demand
 					# layer change will be triggered here if action.tap is not defined
-					layer_action = LayerAction(action.layer, action.hold)
-					logger.debug("trigger CompositeAction layer+hold")
-					await self.trigger_key_action(self.undetermined_key_index, pressed, layer_action)
-					self.undetermined_key_index = -1
+					if _debug:
+						logger.debug("trigger CompositeAction layer+hold")
+					await self.trigger_key_action(key_index, True, action.layer_hold)
 				elif time_delta < action.long_hold_start_ms:
 					# no action for this key
-					logger.debug("no action for CompositeAction")
-					self.undetermined_key_index = -1
-				# long press action shouldn't be determined by a new key press
-				# so not processed here
-			else:
-				# regularly check the time since key with composite action pressed
-				if not pressed:
-					# now key action determined by a release event
-					if time_delta < action.tap_term_ms:
-						# trigger tap action
+					if _debug:
+						logger.debug("no action for CompositeAction")
+				else:
+					if _debug:
+						logger.debug("trigger Composite action long hold")
+					await self.trigger_key_action(key_index, True, action.long_hold)
+				self.clear_pending_key(key_index)
+			elif not pressed:
+				# now key action determined by a release event
+				if time_delta < action.tap_term_ms:
+					# trigger tap action
+					if _debug:
 						logger.debug("trigger CompositeAction tap")
-						await self.trigger_key_action(self.undetermined_key_index, True, action.tap)
-						await self.trigger_key_action(self.undetermined_key_index, False)
-						self.undetermined_key_index = -1
-					elif time_delta < action.hold_term_ms:
-						# trigger hold action
-						# no need to change layer, since no combo key
+					await self.trigger_key_action(key_index, True, action.tap)
+					await self.trigger_key_action(key_index, False)
+				elif time_delta < action.hold_term_ms:
+					# trigger hold action
+					# no need to change layer, since no combo key
+					if _debug:
 						logger.debug("trigger CompositeAction hold, no change layer")
-						await self.trigger_key_action(self.undetermined_key_index, True, action.hold)
-						await self.trigger_key_action(self.undetermined_key_index, False)
-						self.undetermined_key_index = -1
-					else:
-						# simply no action
-						logger.debug("no action for CompositeAction")
-						self.undetermined_key_index = -1
+					await self.trigger_key_action(key_index, True, action.hold)
+					await self.trigger_key_action(key_index, False)
 				else:
-					# check if (long) hold action should be triggered
-					if (action.long_hold is None) and (time_delta > action.tap_term_ms):
+					# simply no action
+					if _debug:
+						logger.debug("no action for CompositeAction")
+				self.clear_pending_key(key_index)
+			else:
+				# check if (long) hold action should be triggered
+				if (action.long_hold is NO_ACTION) and (time_delta > action.tap_term_ms):
+					if _debug:
 						logger.debug("trigger Composite action hold+layer")
-						layer_action = LayerAction(action.layer, action.hold)
-						await self.trigger_key_action(self.undetermined_key_index, pressed, layer_action)
-						self.undetermined_key_index = -1
-					elif time_delta > action.long_hold_start_ms:
-						# trigger long hold action
+					await self.trigger_key_action(key_index, True, action.layer_hold)
+					self.clear_pending_key(key_index)
+				elif time_delta > action.long_hold_start_ms:
+					# trigger long hold action
+					if _debug:
 						logger.debug("trigger Composite action long hold")
-						await self.trigger_key_action(self.undetermined_key_index, pressed, action.long_hold)
-						self.undetermined_key_index = -1
-		elif isinstance(action, TapDance):
-			if (new_press_index >= 0) and (new_press_index != self.undetermined_key_index):
-				# determined by new press
-				logger.debug("trigger TapDance key #%d", self.undetermined_tap_dance_action_index)
-				tap_dance_action = action[self.undetermined_tap_dance_action_index]
-				if self.undetermined_tap_dance_pressed:
-					# press down
-					await self.trigger_key_action(self.undetermined_key_index, True, tap_dance_action)
-				else:
+					await self.trigger_key_action(key_index, True, action.long_hold)
+					self.clear_pending_key(key_index)
+		elif kind == _ACT_TAP_DANCE:
+			tap_dance_actions, tap_term_ms = action
+			# decided by another key, or when the time since last press exceeds tap_term_ms
+			if interrupted or time_delta > tap_term_ms:
+				taps = self.pending_taps[key_index]
+				if _debug:
+					logger.debug("trigger TapDance key #%d", taps)
+				tap_dance_action = tap_dance_actions[taps]
+				await self.trigger_key_action(key_index, True, tap_dance_action)
+				if not self.pending_pressed[key_index]:
 					# click once
-					await self.trigger_key_action(self.undetermined_key_index, True, tap_dance_action)
-					await self.trigger_key_action(self.undetermined_key_index, False)
-				self.undetermined_key_index = -1
-			else:
-				# check regularly if time since last press exceeds tap_term_ms
-				if time_delta > action.tap_term_ms:
-					logger.debug("trigger TapDance key #%d", self.undetermined_tap_dance_action_index)
-					tap_dance_action = action[self.undetermined_tap_dance_action_index]
-					# trigger action
-					if self.undetermined_tap_dance_pressed:
-						# press down
-						await self.trigger_key_action(self.undetermined_key_index, True, tap_dance_action)
-					else:
-						# click once
-						await self.trigger_key_action(self.undetermined_key_index, True, tap_dance_action)
-						await self.trigger_key_action(self.undetermined_key_index, False)
-					self.undetermined_key_index = -1
+					await self.trigger_key_action(key_index, False)
+				self.clear_pending_key(key_index)
 		else:
-			logger.warning("Unknown undetermined action: `%s'", action)
+			logger.warning("Unknown pending action: `%s'", action)
 
-	async def trigger_key_action(self, key_index, pressed, action=None) -> None:
+	async def trigger_key_action(self, key_index, pressed, action=NO_ACTION) -> None:
 		# the specific action is passed/selected by other part of the code
 		# this function maintains the following internal states:
 		# - key_actions
-		# - layer_tracker
-		# Note: here all actions are raw actions, among None, string, number, and callable
+		# - layer states
+		# Note: here all actions are compiled actions, see compile_action
+		stats = self.memory_stats
+		if stats is not None:
+			mem_alloc = gc.mem_alloc()
+			gc_freed = stats.gc_freed
 		if pressed:
-			if isinstance(action, LayerAction):
-				if action.layer is not None:
-					logger.debug("Switching to layer: `%s'", action.layer)
-					self.push_layer(action.layer)
-				real_action = action.action
-				await self.trigger_key_press_action(real_action)
-				self.key_actions[key_index] = action
-			else:
-				self.key_actions[key_index] = await self.trigger_key_press_action(action)
+			self.key_actions[key_index] = await self.press_action(action)
 		else:
 			# use recorded action
-			if action is None:
-				action = self.key_actions[key_index]
-			if isinstance(action, LayerAction):
-				if action.layer is not None:
-					logger.debug("Removing layer: `%s'", action.layer)
-					self.pop_layer(action.layer)
-				real_action = action.action
-				await self.trigger_key_release_action(real_action)
-				self.key_actions[key_index] = None
-			else:
-				self.key_actions[key_index] = await self.trigger_key_release_action(action)
-
-	async def trigger_key_press_action(self, action) -> object:
-		if callable(action):
-			logger.debug("Triggering function call")
+			action = self.key_actions[key_index]
+			self.key_actions[key_index] = NO_ACTION
+			await self.release_action(action)
+		if stats is not None:
+			stats.record_action(action[0], mem_alloc, gc_freed)
+
+	async def press_action(self, action) -> tuple:
+		# press a compiled action, returns the action to be released later
+		kind, payload = action
+		if kind == _ACT_KEY:
+			if _debug:
+				logger.debug("Triggering raw keycode: %s", payload)
+			self.press_kbd_key(payload)
+			return action
+		elif kind == _ACT_CONSUMER:
+			if _debug:
+				logger.debug("Triggering consumer control keycode: %s", payload)
+			self.press_cc_key(payload)
+			return action
+		elif kind == _ACT_MOUSE:
+			if _debug:
+				logger.debug("Trigger pressing mouse action: %s", payload)
+			self.press_mouse_key(payload)
+			return action
+		elif kind == _ACT_NONE:
+			return NO_ACTION
+		elif kind == _ACT_LAYER:
+			layer, real_action = payload
+			if _debug:
+				logger.debug("Switching to layer: `%s'", self.layer_names[layer])
+			self.push_layer(layer)
+			await self.press_action(real_action)
+			return action
+		elif kind == _ACT_FUNCTION:
+			if _debug:
+				logger.debug("Triggering function call")
+			# user functions run unbatched, they may wait or rely on report timing
+			batching = self.end_hid_batch()
 			self.release_and_clear_queue()
 			# run the function
 			try:
-				result = action(self)
+				result = payload(self)
 				# check if result is a coroutine, await it if so(it's an async function)
 				if is_coroutine(result):
 					result = await result
-				logger.debug("Function call result: %s", result)
+				if _debug:
+					logger.debug("Function call result: %s", result)
 			except Exception as e:
 				logger.error("Function call raised an exception: %s: %s", e.__class__.__name__, e)
 			self.release_and_clear_queue()
 			# we can no longer track key release events occured when executing the user funcion
-			self.reset_layer_tracker()
-			gc.collect()
-			return None
-		elif isinstance(action, str):
-			logger.debug("Sending string: %s", action)
-			self.release_all_hid()
-			self.send_text(action)
-			return None
-		elif isinstance(action, ConsumerCode):
-			logger.debug("Triggering consumer control keycode: %s", action)
-			self.press_cc_key(action)
-			return action
-		elif isinstance(action, MouseCode):
-			logger.debug("Trigger pressing mouse action: %s", action)
-			self.press_mouse_key(int(action))
-			return action
-		elif isinstance(action, int):
-			logger.debug("Triggering raw keycode: %s", action)
-			self.press_kbd_key(action)
-			return action
-		elif isinstance(action, KeySequence):
-			delay = Delay(action.delay)
-			for act in action:
-				await self.trigger_key_press_action(act)
-				await self.trigger_key_release_action(act)
-				await self.trigger_key_press_action(delay)
-		elif isinstance(action, KeyCombination):
-			for act in action:
-				await self.trigger_key_press_action(act)
-			delay = Delay(action.delay)
-			await self.trigger_key_press_action(delay)
-			for act in action:
-				await self.trigger_key_release_action(act)
-		elif isinstance(action, Delay):
-			if action.delay > 0:
-				await asyncio.sleep(action.delay)
-		elif action is not None:
-			logger.debug("Unhandled key press action: %s/%s", action.__class__.__name__, action)
-
-	async def trigger_key_release_action(self, action) -> object:
-		if isinstance(action, ConsumerCode):
+			self.reset_layers()
+			self.reset_key_actions()
+			if self.animator is not None:
+				# the function may have written the pixels directly
+				self.animator.invalidate()
+			self.collect_garbage()
+			if batching:
+				self.begin_hid_batch()
+		elif kind == _ACT_TEXT:
+			if _debug:
+				logger.debug("Sending string of %d characters", len(payload) // 2)
+			# the string of a key streams in the background, see type_text for text in order
+			self.text_streamer.write(payload)
+		elif kind == _ACT_SEQUENCE or kind == _ACT_COMBINATION:
+			if _debug:
+				logger.debug("Running macro of %d ops", len(payload[0]) // 3)
+			await self.run_macro(payload)
+		elif kind == _ACT_DELAY:
+			if payload > 0:
+				# never hold reports back while waiting
+				batching = self.end_hid_batch()
+				await asyncio.sleep(payload)
+				if batching:
+					self.begin_hid_batch()
+		else:
+			if _debug:
+				logger.debug("Unhandled key press action: %d/%s", kind, payload)
+		return NO_ACTION
+
+	async def run_macro(self, macro: tuple) -> None:
+		# run a macro of compile_macro, the interpreter itself allocates nothing
+		program, constants = macro
+		for i in range(0, len(program), 3):
+			op = program[i]
+			arg = program[i + 1] | (program[i + 2] << 8)
+			if op == _OP_DELAY:
+				# never hold reports back while waiting
+				batching = self.end_hid_batch()
+				await asyncio.sleep_ms(arg)
+				if batching:
+					self.begin_hid_batch()
+			elif op == _OP_TEXT:
+				# the next op waits for the text
+				await self.type_text(constants[arg])
+			elif op == _OP_CALL:
+				await self.press_action(constants[arg])
+			else:
+				# a failed report is dropped like in the no_fail HID methods
+				try:
+					if op == _OP_TAP:
+						self.keyboard.press_key(arg)
+						self.keyboard.release_key(arg)
+					elif op == _OP_PRESS:
+						self.keyboard.press_key(arg)
+					elif op == _OP_RELEASE:
+						self.keyboard.release_key(arg)
+					elif op == _OP_CONSUMER_TAP:
+						self.consumer_control.send(arg)
+					elif op == _OP_CONSUMER_PRESS:
+						self.consumer_control.press(arg)
+					elif op == _OP_CONSUMER_RELEASE:
+						self.consumer_control.release()
+					elif op == _OP_MOUSE_TAP:
+						self.mouse.click(arg)
+					elif op == _OP_MOUSE_PRESS:
+						self.mouse.press(arg)
+					elif op == _OP_MOUSE_RELEASE:
+						self.mouse.release(arg)
+				except Exception as e:
+					logger.debug('Ignore exception: %s: %s', e.__class__.__name__, e)
+
+	async def release_action(self, action) -> None:
+		# release a compiled action returned by press_action
+		kind, payload = action
+		if kind == _ACT_KEY:
+			self.release_kbd_key(payload)
+		elif kind == _ACT_CONSUMER:
 			self.release_cc_key()
-		elif isinstance(action, MouseCode):
-			self.release_mouse_key(action)
-		elif isinstance(action, int):
-			self.release_kbd_key(action)
-		elif action is not None:
-			logger.debug("Unhandled key release action: %s/%s", action.__class__.__name__, action)
-		return None
+		elif kind == _ACT_MOUSE:
+			self.release_mouse_key(payload)
+		elif kind == _ACT_LAYER:
+			layer, real_action = payload
+			if _debug:
+				logger.debug("Removing layer: `%s'", self.layer_names[layer])
+			self.pop_layer(layer)
+			await self.release_action(real_action)
+
+	async def trigger_key_press_action(self, action) -> None:
+		# press a raw keymap action, for custom functions
+		action = self.compile_action(action)
+		if action[0] == _ACT_TEXT:
+			# the function's next action comes after the text
+			await self.type_text(action[1])
+		else:
+			await self.press_action(action)
+
+	async def trigger_key_release_action(self, action) -> None:
+		# release a raw keymap action, for custom functions
+		await self.release_action(self.compile_action(action))
 
 	@no_fail_tag('push_layer')
 	def push_layer(self, layer):
-		self.layer_tracker.append(layer)
+		# several keys may hold the same layer, it stays active until all are released
+		# the layer goes on top, also when another key holds it already
+		self.layer_refcounts[layer] += 1
+		if layer == self.top_layer:
+			return
+		if self.layer_refcounts[layer] > 1:
+			self.unlink_layer(layer)
+		below = self.top_layer
+		self.layer_below[layer] = below
+		self.layer_above[layer] = -1
+		if below >= 0:
+			self.layer_above[below] = layer
+		self.top_layer = layer
+		self.active_layer = layer
+		self.update_effective_actions()
 
 	@no_fail_tag('pop_layer')
 	def pop_layer(self, layer):
-		# FIXME: this is not robust if multiple sequencial keys point to the same layer
-		if len(self.layer_tracker) > 1:
-			self.layer_tracker.remove(layer)
+		refcounts = self.layer_refcounts
+		if refcounts[layer] == 0:
+			return
+		refcounts[layer] -= 1
+		if refcounts[layer] > 0:
+			return
+		self.unlink_layer(layer)
+		self.update_effective_actions()
+
+	def unlink_layer(self, layer: int) -> None:
+		# take a held layer out of the activation order
+		below = self.layer_below[layer]
+		above = self.layer_above[layer]
+		if below >= 0:
+			self.layer_above[below] = above
+		if above >= 0:
+			self.layer_below[above] = below
+		else:
+			# it was on top
+			self.top_layer = below
+			self.active_layer = below if below >= 0 else self.base_layer
+
+	def update_effective_actions(self) -> None:
+		# resolve transparent keys through the held layers, last activated first, then the default layer
+		# only runs when a layer is activated or deactivated, a key lookup is a single index
+		layers = self.layers
+		below = self.layer_below
+		stack = []
+		layer = self.top_layer
+		while layer >= 0:
+			stack.append(layers[layer])
+			layer = below[layer]
+		stack.append(layers[self.base_layer])
+		effective = self.effective_actions
+		for key_index in range(len(effective)):
+			action = NO_ACTION
+			for layer in stack:
+				if key_index < len(layer) and layer[key_index] is not _TRANSPARENT_ACTION:
+					action = layer[key_index]
+					break
+			effective[key_index] = action
 
 	def release_and_clear_queue(self) -> None:
 		self.release_all_hid()
@@ -633,13 +1235,52 @@ class LemonKeypad:
 		self.consumer_control.release()
 		self.mouse.release_all()
 
+	def begin_hid_batch(self) -> None:
+		# defer HID reports until end_hid_batch
+		if not self.batch_hid_reports:
+			return
+		self.hid_batch_active = True
+		for device in (self.keyboard, self.mouse, self.consumer_control):
+			if device is not None:
+				device.begin_batch()
+
+	def end_hid_batch(self) -> bool:
+		# send the pending HID reports, returns whether a batch was active
+		if not self.hid_batch_active:
+			return False
+		self.hid_batch_active = False
+		for device in (self.keyboard, self.mouse, self.consumer_control):
+			if device is not None:
+				self.end_device_batch(device)
+		return True
+
+	@no_fail
+	def end_device_batch(self, device) -> None:
+		device.end_batch()
+
 	def clear_queue(self) -> None:
 		self.key_scanner.events.clear()
 
-	def reset_layer_tracker(self) -> None:
-		if self.layer_tracker is not None:
-			self.layer_tracker.clear()
-			self.layer_tracker.append(self.default_layer)
+	def reset_layers(self) -> None:
+		refcounts = self.layer_refcounts
+		if refcounts is not None:
+			for i in range(len(refcounts)):
+				refcounts[i] = 0
+			self.top_layer = -1
+			self.base_layer = self.layer_ids[self.default_layer]
+			self.active_layer = self.base_layer
+			self.update_effective_actions()
+
+	def reset_key_actions(self) -> None:
+		# forget the pending keys and the actions of the held keys, their releases are lost
+		pending_actions = self.pending_actions
+		for key_index in self.pending_keys:
+			pending_actions[key_index] = NO_ACTION
+		self.pending_keys.clear()
+		self.deadline_timer.clear()
+		key_actions = self.key_actions
+		for i in range(len(key_actions)):
+			key_actions[i] = NO_ACTION
 
 	@no_fail
 	def press_kbd_key(self, *keycodes: int) -> None:
@@ -685,8 +1326,7 @@ class LemonKeypad:
 	def load_keyboard(self) -> bool:
 		try:
 			if self.keyboard is None:
-				self.keyboard = Keyboard(usb_hid.devices)
-				self.keyboard_layout = KeyboardLayoutUS(self.keyboard)
+				self.keyboard = self.create_keyboard()
 				logger.debug("Keyboard HID interface loaded")
 			return True
 		except OSError:
@@ -697,6 +1337,16 @@ class LemonKeypad:
 			self.keyboard = None
 		return False
 
+	def create_keyboard(self) -> Keyboard:
+		if self.keyboard_nkro and usb_hid.get_boot_device() != 1:
+			try:
+				keyboard = NKROKeyboard(usb_hid.devices)
+				logger.debug("Using N-key rollover keyboard")
+				return keyboard
+			except ValueError:
+				pass
+		return Keyboard(usb_hid.devices)
+
 	def load_mouse(self) -> bool:
 		try:
 			if self.mouse is None:
@@ -729,14 +1379,51 @@ class LemonKeypad:
 
 	@no_fail
 	def send_text(self, text: str, delay: float = None):
+		if self.keyboard_layout is None or self.keyboard_layout.keyboard is not self.keyboard:
+			from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+			self.keyboard_layout = KeyboardLayoutUS(self.keyboard)
 		self.keyboard_layout.write(text, delay)
 
+	async def type_text(self, codes: bytearray) -> None:
+		# type a string compiled by compile_text, after the text already streaming, and wait until done
+		# the streamer's reports go out as it types them, not with the batch
+		batching = self.end_hid_batch()
+		self.text_streamer.write(codes)
+		await self.text_streamer.wait()
+		if batching:
+			self.begin_hid_batch()
+
+	def stream_text(self, text: str) -> None:
+		# type text in the background, at text_rate_cps
+		self.text_streamer.write(compile_text(text))
+
 	def get_key_event(self):
 		return self.key_scanner.events.get()
 
 	def disable_watchdog(self):
 		wdt.mode = None
 
+	def enable_memory_stats(self) -> None:
+		# measure the heap use of key actions and user tasks, call before running
+		from .memstats import MemoryStats
+		self.memory_stats = MemoryStats(_ACT_NAMES)
+
+	def print_memory_stats(self) -> None:
+		# dump to the serial console
+		if self.memory_stats is None:
+			print("memory stats not enabled, free heap: %d" % gc.mem_free())
+		else:
+			print(self.memory_stats.report())
+
+	def print_startup_report(self) -> None:
+		print(self.startup.report())
+
+	def collect_garbage(self) -> None:
+		if self.memory_stats is not None:
+			self.memory_stats.collect()
+		else:
+			gc.collect()
+
 	def enable_watchdog(self, timeout = WDT_TIMEOUT):
 		wdt.timeout = max(timeout, WDT_TIMEOUT)
 		try:
@@ -747,3 +1434,6 @@ class LemonKeypad:
 		except NotImplementedError:
 			wdt.mode = WatchDogMode.RESET
 		wdt.feed()
+
+
+_startup.mark("imports")
@@ -0,0 +1,174 @@
+# NeoPixel animation engine
+#
+# Effects draw into a preallocated frame buffer, the engine renders them at a
+# fixed frame rate and only sends the pixels to the LEDs when the frame changed.
+# Drawing is cheap and the LED output costs at most one show() per frame.
+#
+# The LEDs stay untouched until something is drawn, so user functions may still
+# write keypad.pixels directly. After such writes (see invalidate) the next
+# changed frame is sent whole.
+#
+# An effect is a generator, each step draws one frame:
+#   def blink(animator, color):
+#       while True:
+#           animator.fill(color)
+#           for _ in range(15): yield
+#           animator.fill(0)
+#           for _ in range(15): yield
+#   effect = keypad.animator.play(blink(keypad.animator, 0x200000))
+#   ...
+#   keypad.animator.stop(effect)
+
+from micropython import const
+import asyncio
+
+from supervisor import ticks_ms
+from . import log as logging
+
+from .timer import ticks_add, ticks_diff
+
+logger = logging.getLogger("LemonKeypad")
+
+_CHANNELS = const(3)  # r, g, b
+
+
+class PixelAnimator:
+	def __init__(self, pixels, fps: int = 30) -> None:
+		if not 0 < fps <= 1000:
+			raise ValueError("Frame rate must be within 1-1000 fps")
+		self.pixels = pixels
+		self.n = pixels.n
+		self.period_ms = 1000 // fps
+		self.frame = bytearray(self.n * _CHANNELS)  # drawn by the effects
+		self._shown = bytearray(self.n * _CHANNELS)  # the last frame sent
+		self._resend = True  # the LEDs may not show _shown, send every pixel
+		self.effects = []  # running effects, drawn in order
+		self.now = 0  # ticks_ms() of the frame being drawn
+		self.frame_count = 0  # frames drawn
+		self.show_count = 0  # frames sent to the LEDs
+		self._wake = asyncio.Event()
+
+	### Drawing ###
+
+	def __len__(self) -> int:
+		return self.n
+
+	def __setitem__(self, index: int, color) -> None:
+		# color: (r, g, b) or 0xRRGGBB
+		frame = self.frame
+		i = index * _CHANNELS
+		if isinstance(color, int):
+			frame[i] = (color >> 16) & 0xFF
+			frame[i + 1] = (color >> 8) & 0xFF
+			frame[i + 2] = color & 0xFF
+		else:
+			# computed colors may be floats or slightly out of range
+			frame[i] = min(255, max(0, int(color[0])))
+			frame[i + 1] = min(255, max(0, int(color[1])))
+			frame[i + 2] = min(255, max(0, int(color[2])))
+		self._wake.set()
+
+	def __getitem__(self, index: int) -> int:
+		frame = self.frame
+		i = index * _CHANNELS
+		return (frame[i] << 16) | (frame[i + 1] << 8) | frame[i + 2]
+
+	def fill(self, color) -> None:
+		for i in range(self.n):
+			self[i] = color
+
+	### Effects ###
+
+	def play(self, effect):
+		# effect: a generator drawing one frame per step
+		self.effects.append(effect)
+		self._wake.set()
+		return effect
+
+	def stop(self, effect) -> None:
+		if effect in self.effects:
+			self.effects.remove(effect)
+			effect.close()
+
+	def stop_all(self) -> None:
+		for effect in self.effects:
+			effect.close()
+		self.effects.clear()
+
+	### Rendering ###
+
+	def render(self) -> None:
+		self.frame_count += 1
+		effects = self.effects
+		for effect in effects[:]:
+			try:
+				next(effect)
+			except StopIteration:
+				effects.remove(effect)
+			except Exception as e:  # pylint: disable=broad-except
+				logger.error("Effect stopped: %s: %s", e.__class__.__name__, e)
+				effects.remove(effect)
+
+	def invalidate(self) -> None:
+		# the pixels were written directly, the next changed frame is sent whole
+		self._resend = True
+
+	def show(self) -> bool:
+		# send the changed pixels, return whether anything was sent
+		frame = self.frame
+		shown = self._shown
+		if frame == shown:
+			return False
+		pixels = self.pixels
+		resend = self._resend
+		# one show() for the whole frame, the user's auto_write setting is kept
+		auto_write = pixels.auto_write
+		pixels.auto_write = False
+		for index in range(self.n):
+			i = index * _CHANNELS
+			if resend or frame[i] != shown[i] or frame[i + 1] != shown[i + 1] or frame[i + 2] != shown[i + 2]:
+				pixels[index] = (frame[i] << 16) | (frame[i + 1] << 8) | frame[i + 2]
+		shown[:] = frame
+		self._resend = False
+		pixels.show()
+		pixels.auto_write = auto_write
+		self.show_count += 1
+		return True
+
+	async def run(self) -> None:
+		period = self.period_ms
+		next_tick = ticks_ms()
+		while True:
+			if not self.effects and self.frame == self._shown:
+				# nothing to animate, sleep until something is drawn or played
+				self._wake.clear()
+				await self._wake.wait()
+				next_tick = ticks_ms()
+
+			self.now = next_tick
+			self.render()
+			self.show()
+
+			# fixed frame grid, frames missed while busy are dropped
+			next_tick = ticks_add(next_tick, period)
+			delay = ticks_diff(next_tick, ticks_ms())
+			if delay < 0:
+				missed = -delay // period + 1
+				next_tick = ticks_add(next_tick, missed * period)
+				delay += missed * period
+			await asyncio.sleep_ms(delay)
+
+
+def breathe(animator: PixelAnimator, color, period_ms: int = 3000):
+	# fade all pixels in and out, the built-in example effect
+	if isinstance(color, int):
+		r, g, b = (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF
+	else:
+		r, g, b = color
+	start = animator.now
+	half = period_ms // 2
+	while True:
+		phase = ticks_diff(animator.now, start) % period_ms
+		level = phase if phase < half else period_ms - phase
+		animator.fill((((r * level) // half) << 16) | (((g * level) // half) << 8) | ((b * level) // half))
+		yield
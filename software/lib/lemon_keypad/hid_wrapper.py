@@ -1,5 +1,8 @@
 # adafruit_hid but modified
 
+import struct
+
+from micropython import const
 from adafruit_hid.keyboard import Keyboard as KB
 from adafruit_hid.mouse import Mouse as MS
 from adafruit_hid.consumer_control import ConsumerControl as CC
@@ -11,12 +14,20 @@ except:  # pylint: disable=bare-except
 	pass
 
 
+# N-key rollover keyboard, its descriptor is registered by boot.py
+NKRO_REPORT_LENGTH = const(16)  # modifiers + bitmap of usages 0x00-0x77
+NKRO_MAX_KEYCODE = const(0x77)
+
+
 def find_device(
 	devices: Sequence[object],
 	*,
 	usage_page: int,
 	usage: int,
+	index: int = 0,
 ) -> object:
+	# index: which of the matching devices, in the order boot.py enabled them
+	# usb_hid.devices holds copies of the enabled devices, usb_hid.Device.KEYBOARD is never one of them
 	if hasattr(devices, "send_report"):
 		devices = [devices]  # type: ignore
 	device = None
@@ -26,15 +37,51 @@ def find_device(
 			and dev.usage == usage
 			and hasattr(dev, "send_report")
 		):
-			device = dev
-			break
+			if index == 0:
+				device = dev
+				break
+			index -= 1
 	if device is None:
 		raise ValueError("Could not find matching HID device.")
 
 	return device
 
 
-class Keyboard(KB):
+class ReportBatching:
+	# While `deferred', report changes are kept in place and sent by flush(),
+	# so a burst of changes goes out as a single report per interface.
+	# A usage changes at most once per report: changing it again flushes
+	# the pending report first, so no press or release is ever lost.
+	deferred = False
+	_pending = False
+
+	def begin_batch(self) -> None:
+		self.deferred = True
+
+	def end_batch(self) -> None:
+		self.deferred = False
+		self.flush()
+
+	def flush(self) -> None:
+		if self._pending:
+			self._pending = False
+			self._clear_changed()
+			self._send_report()
+
+	def _report_changed(self) -> None:
+		if self.deferred:
+			self._pending = True
+		else:
+			self._send_report()
+
+	def _clear_changed(self) -> None:
+		pass
+
+	def _send_report(self) -> None:
+		raise NotImplementedError
+
+
+class Keyboard(ReportBatching, KB):
 	def __init__(self, devices: Sequence[usb_hid.Device], timeout: int = None) -> None:
 		self._keyboard_device = find_device(
 			devices, usage_page=0x1, usage=0x06
@@ -57,8 +104,63 @@ class Keyboard(KB):
 		# No keyboard LEDs on.
 		self._led_status = b"\x00"
 
+		# Bitmap of keycodes changed in the pending report.
+		self._changed = bytearray(32)
+
+	def press(self, *keycodes: int) -> None:
+		for keycode in keycodes:
+			self._change(keycode)
+			self._add_keycode_to_report(keycode)
+		self._report_changed()
 
-class Mouse(MS):
+	def release(self, *keycodes: int) -> None:
+		for keycode in keycodes:
+			self._change(keycode)
+			self._remove_keycode_from_report(keycode)
+		self._report_changed()
+
+	def press_key(self, keycode: int) -> None:
+		# press() of a single key, without the arguments tuple
+		self._change(keycode)
+		self._add_keycode_to_report(keycode)
+		self._report_changed()
+
+	def release_key(self, keycode: int) -> None:
+		self._change(keycode)
+		self._remove_keycode_from_report(keycode)
+		self._report_changed()
+
+	def release_all(self) -> None:
+		if self.deferred:
+			modifiers = self.report_modifier[0]
+			for i in range(8):
+				if modifiers & (1 << i):
+					self._change(0xE0 + i)
+			for keycode in self.report_keys:
+				if keycode:
+					self._change(keycode)
+		for i in range(8):
+			self.report[i] = 0
+		self._report_changed()
+
+	def _change(self, keycode: int) -> None:
+		if self.deferred:
+			index = keycode >> 3
+			mask = 1 << (keycode & 7)
+			if self._changed[index] & mask:
+				self.flush()
+			self._changed[index] |= mask
+
+	def _clear_changed(self) -> None:
+		changed = self._changed
+		for i in range(len(changed)):
+			changed[i] = 0
+
+	def _send_report(self) -> None:
+		self._keyboard_device.send_report(self.report)
+
+
+class Mouse(ReportBatching, MS):
 	def __init__(self, devices: Sequence[usb_hid.Device], timeout: int = None) -> None:
 		self._mouse_device = find_device(
 			devices, usage_page=0x1, usage=0x02
@@ -71,8 +173,47 @@ class Mouse(MS):
 		# report[3] wheel movement
 		self.report = bytearray(4)
 
+		# Buttons changed in the pending report.
+		self._changed = 0
+
+	def press(self, buttons: int) -> None:
+		self._change(buttons)
+		self.report[0] |= buttons
+		self._report_changed()
+
+	def release(self, buttons: int) -> None:
+		self._change(buttons)
+		self.report[0] &= ~buttons
+		self._report_changed()
+
+	def release_all(self) -> None:
+		self._change(self.report[0])
+		self.report[0] = 0
+		self._report_changed()
+
+	def move(self, x: int = 0, y: int = 0, wheel: int = 0) -> None:
+		# movements are relative, they are never merged
+		self.flush()
+		super().move(x, y, wheel)
 
-class ConsumerControl(CC):
+	def _change(self, buttons: int) -> None:
+		if self.deferred:
+			if self._changed & buttons:
+				self.flush()
+			self._changed |= buttons
+
+	def _clear_changed(self) -> None:
+		self._changed = 0
+
+	def _send_report(self) -> None:
+		# button-only report
+		self.report[1] = 0
+		self.report[2] = 0
+		self.report[3] = 0
+		self._mouse_device.send_report(self.report)
+
+
+class ConsumerControl(ReportBatching, CC):
 	def __init__(self, devices: Sequence[usb_hid.Device], timeout: int = None) -> None:
 		self._consumer_device = find_device(
 			devices, usage_page=0x0C, usage=0x01
@@ -80,3 +221,78 @@ class ConsumerControl(CC):
 
 		# Reuse this bytearray to send consumer reports.
 		self._report = bytearray(2)
+
+	def press(self, consumer_code: int) -> None:
+		# only one code at a time, each change gets its own report
+		self.flush()
+		struct.pack_into("<H", self._report, 0, consumer_code)
+		self._report_changed()
+
+	def release(self) -> None:
+		self.flush()
+		self._report[0] = self._report[1] = 0x0
+		self._report_changed()
+
+	def _send_report(self) -> None:
+		self._consumer_device.send_report(self._report)
+
+
+class NKROKeyboard(Keyboard):
+	# Bitmap report, any number of keys can be held at once.
+	# Pressing or releasing a key is a single bit operation.
+	def __init__(self, devices: Sequence[usb_hid.Device], timeout: int = None) -> None:
+		# boot.py enables the NKRO keyboard right after the boot keyboard,
+		# without a second keyboard device there is no NKRO report
+		self._nkro_device = find_device(
+			devices, usage_page=0x1, usage=0x06, index=1
+		)
+		# keyboard LEDs are still reported on the boot keyboard
+		self._keyboard_device = find_device(
+			devices, usage_page=0x1, usage=0x06
+		)
+
+		# report[0] modifiers
+		# report[1:16] bitmap of keycodes 0x00-0x77, keycode k is bit (k & 7) of report[1 + (k >> 3)]
+		self.report = bytearray(NKRO_REPORT_LENGTH)
+		self.report_modifier = memoryview(self.report)[0:1]
+
+		self._led_status = b"\x00"
+
+		# Bitmap of keycodes changed in the pending report.
+		self._changed = bytearray(32)
+
+	def release_all(self) -> None:
+		report = self.report
+		if self.deferred:
+			# modifiers are keycodes 0xE0-0xE7, bits of _changed[28]
+			changed = self._changed
+			if changed[28] & report[0]:
+				self.flush()
+			else:
+				for i in range(1, NKRO_REPORT_LENGTH):
+					if changed[i - 1] & report[i]:
+						self.flush()
+						break
+			changed[28] |= report[0]
+			for i in range(1, NKRO_REPORT_LENGTH):
+				changed[i - 1] |= report[i]
+		for i in range(NKRO_REPORT_LENGTH):
+			report[i] = 0
+		self._report_changed()
+
+	def _add_keycode_to_report(self, keycode: int) -> None:
+		if 0xE0 <= keycode <= 0xE7:
+			self.report[0] |= 1 << (keycode - 0xE0)
+		elif 0 <= keycode <= NKRO_MAX_KEYCODE:
+			self.report[1 + (keycode >> 3)] |= 1 << (keycode & 7)
+		else:
+			raise ValueError("Keycode out of the NKRO report: 0x%x" % keycode)
+
+	def _remove_keycode_from_report(self, keycode: int) -> None:
+		if 0xE0 <= keycode <= 0xE7:
+			self.report[0] &= ~(1 << (keycode - 0xE0))
+		elif 0 <= keycode <= NKRO_MAX_KEYCODE:
+			self.report[1 + (keycode >> 3)] &= ~(1 << (keycode & 7))
+
+	def _send_report(self) -> None:
+		self._nkro_device.send_report(self.report)
@@ -0,0 +1,179 @@
+# Shared IMU sampling
+#
+# One task reads the sensor at a fixed rate into a preallocated ring buffer,
+# consumers read the latest sample or a window of recent ones from there
+# instead of polling the sensor themselves. Sampling pauses while nobody is
+# subscribed, so the I2C bus stays quiet when the IMU isn't used.
+
+from micropython import const
+from array import array
+import asyncio
+
+from supervisor import ticks_ms
+from ulab import numpy as np
+from . import log as logging
+
+from .timer import ticks_add, ticks_diff
+
+logger = logging.getLogger("LemonKeypad")
+
+# sample columns
+GYRO_X = const(0)
+GYRO_Y = const(1)
+GYRO_Z = const(2)
+ACCEL_X = const(3)
+ACCEL_Y = const(4)
+ACCEL_Z = const(5)
+SAMPLE_WIDTH = const(6)
+
+
+class IMUSampler:
+	def __init__(self, imu, rate_hz: int = 100, buffer_size: int = 32) -> None:
+		if not 0 < rate_hz <= 1000:
+			raise ValueError("IMU sample rate must be within 1-1000 Hz")
+		if buffer_size < 1:
+			raise ValueError("IMU buffer size must be positive")
+		self.imu = imu
+		# a backend with a FIFO, e.g. LSM6DSFIFO, hands over all samples queued since the last read
+		self.batched = hasattr(imu, "read_into")
+		self._batch = np.zeros((buffer_size, SAMPLE_WIDTH)) if self.batched else None
+		self.period_ms = 1000 // rate_hz
+		self.samples = np.zeros((buffer_size, SAMPLE_WIDTH))  # ring buffer, one sample per row
+		self.timestamps = array("l", [0] * buffer_size)  # ticks_ms() of each row
+		self.buffer_size = buffer_size
+		self.count = 0  # samples taken so far, the latest one is in row (count - 1) % buffer_size
+		self.overruns = 0  # sample slots skipped because the task was late
+		self.consumers = 0
+		self._resume = asyncio.Event()  # set while there are consumers
+		self._sampled = asyncio.Event()  # pulsed after each sample
+
+	### Consumer interface ###
+
+	def subscribe(self) -> None:
+		self.consumers += 1
+		self._resume.set()
+
+	def unsubscribe(self) -> None:
+		if self.consumers > 0:
+			self.consumers -= 1
+			if self.consumers == 0:
+				self._resume.clear()
+
+	async def wait(self) -> None:
+		# wait for the next sample
+		await self._sampled.wait()
+
+	@property
+	def latest_index(self) -> int:
+		# row of the latest sample, -1 if nothing is sampled yet
+		if self.count == 0:
+			return -1
+		return (self.count - 1) % self.buffer_size
+
+	@property
+	def gyro(self) -> tuple:
+		row = self.latest_index
+		samples = self.samples
+		return (samples[row, GYRO_X], samples[row, GYRO_Y], samples[row, GYRO_Z]) if row >= 0 else (0.0, 0.0, 0.0)
+
+	@property
+	def acceleration(self) -> tuple:
+		row = self.latest_index
+		samples = self.samples
+		return (samples[row, ACCEL_X], samples[row, ACCEL_Y], samples[row, ACCEL_Z]) if row >= 0 else (0.0, 0.0, 0.0)
+
+	def window(self, n: int, out=None):
+		# copy the latest n samples into `out' (n rows), oldest first
+		if not 0 < n <= self.buffer_size:
+			raise ValueError("window size must be within 1-%d" % self.buffer_size)
+		if out is None:
+			out = np.zeros((n, SAMPLE_WIDTH))
+		end = self.count % self.buffer_size
+		start = end - n
+		if start >= 0:
+			out[:, :] = self.samples[start:end, :]
+		else:
+			# wrapped around the end of the buffer
+			out[:-start, :] = self.samples[start:, :]
+			if end > 0:
+				out[-start:, :] = self.samples[:end, :]
+		return out
+
+	### Sampling task ###
+
+	def sample(self, timestamp: int) -> None:
+		if self.batched:
+			self.sample_batch(timestamp)
+			return
+		try:
+			gx, gy, gz = self.imu.gyro
+			ax, ay, az = self.imu.acceleration
+		except OSError as e:
+			logger.debug("IMU read failed: %s", e)
+			return
+		row = self.count % self.buffer_size
+		samples = self.samples
+		samples[row, GYRO_X] = gx
+		samples[row, GYRO_Y] = gy
+		samples[row, GYRO_Z] = gz
+		samples[row, ACCEL_X] = ax
+		samples[row, ACCEL_Y] = ay
+		samples[row, ACCEL_Z] = az
+		self.timestamps[row] = timestamp
+		self.count += 1
+		self._sampled.set()
+		self._sampled.clear()
+
+	def sample_batch(self, timestamp: int) -> None:
+		batch = self._batch
+		try:
+			count = self.imu.read_into(batch)
+		except OSError as e:
+			logger.debug("IMU read failed: %s", e)
+			return
+		if count == 0:
+			return
+
+		# copy into the ring, in two parts if it wraps around
+		size = self.buffer_size
+		samples = self.samples
+		row = self.count % size
+		first = min(count, size - row)
+		samples[row:row + first, :] = batch[:first, :]
+		if first < count:
+			samples[:count - first, :] = batch[first:count, :]
+
+		# the samples were taken at the sensor's rate, the latest one just now
+		interval_ms = 1000 / self.imu.rate_hz
+		timestamps = self.timestamps
+		for i in range(count):
+			timestamps[(row + i) % size] = ticks_add(timestamp, -int((count - 1 - i) * interval_ms))
+		self.count += count
+		self._sampled.set()
+		self._sampled.clear()
+
+	async def run(self) -> None:
+		period = self.period_ms
+		next_tick = ticks_ms()
+		while True:
+			if self.consumers == 0:
+				logger.debug("IMU sampling paused")
+				if self.batched:
+					self.imu.stop()
+				await self._resume.wait()
+				logger.debug("IMU sampling resumed")
+				if self.batched:
+					self.imu.start()  # drop the stale samples
+				next_tick = ticks_ms()
+
+			self.sample(next_tick)
+
+			# sample on a fixed grid, skip the slots missed instead of catching up in a burst
+			next_tick = ticks_add(next_tick, period)
+			delay = ticks_diff(next_tick, ticks_ms())
+			if delay < 0:
+				missed = -delay // period + 1
+				self.overruns += missed
+				next_tick = ticks_add(next_tick, missed * period)
+				delay += missed * period
+			await asyncio.sleep_ms(delay)
@@ -1,5 +1,5 @@
 # pylint: disable-msg=invalid-name
-from lemon_keypad import ConsumerCode as CC, MouseCode as MS
+from lemon_keypad import ConsumerCode as CC, MouseCode as MS, TRANSPARENT
 from micropython import const
 
 # Here we define all common keys for ease of use
@@ -8,6 +8,11 @@ from micropython import const
 # 包括键盘按键，鼠标按键，以及多媒体按键
 # Please use search function to find the keycode corresponding to the target symbol
 # 请使用搜索功能来找到目标符号对应的键盘按键码
+# Import the keys a keymap uses from lemon_keypad.keycodes by name, it needs less memory
+# 在键位图中从lemon_keypad.keycodes按名称导入用到的键码，更省内存
+# e.g. 例如: from lemon_keypad.keycodes import A, C_MUTE
+# Run scripts/keycode_table.py after adding keys here, it generates keycodes.py
+# 在这里添加键码后请运行scripts/keycode_table.py，重新生成keycodes.py
 
 ### keyboard keys
 ### 键盘按键键码
@@ -277,6 +282,12 @@ RIGHT_ALT = const(0xE6)
 RIGHT_GUI = const(0xE7)
 # GUI modifier right of the spacebar
 
+### Keymap markers
+### 键位图标记
+
+TRNS = TRANSPARENT
+# Same action as the next active layer below 沿用下一个激活层的按键功能
+
 ### Mouse keys
 ### 鼠标按键
 
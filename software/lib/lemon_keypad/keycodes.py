@@ -0,0 +1,87 @@
+# Generated by scripts/keycode_table.py from keycode_helper.py, don't edit
+#
+# The keycodes of keycode_helper as a few byte strings, looked up by name when
+# they are imported:
+#   from lemon_keypad.keycodes import A, LEFT_CONTROL, C_MUTE, TRNS
+# binds only the listed names, instead of one module global per keycode in
+# keycode_helper and another one in the keymap for each of them with a star
+# import. A star import of this module imports nothing, use keycode_helper
+# for that.
+
+from lemon_keypad import ConsumerCode, MouseCode, TRANSPARENT
+
+# keyboard keys, names and the keycodes in the same order
+_KEY_NAMES = (
+	b" A B C D E F G H I J K L M N O P Q R S T U V W X Y Z N1 ONE N2 TWO N3 "
+	b"THREE N4 FOUR N5 FIVE N6 SIX N7 SEVEN N8 EIGHT N9 NINE N0 ZERO RETURN "
+	b"ENTER ESCAPE BACKSPACE TAB SPACE SPACEBAR MINUS EQUALS LEFT_BRACKET "
+	b"RIGHT_BRACKET BACKSLASH POUND SEMICOLON QUOTE GRAVE_ACCENT COMMA PERIOD "
+	b"FORWARD_SLASH CAPS_LOCK F1 F2 F3 F4 F5 F6 F7 F8 F9 F10 F11 F12 "
+	b"PRINT_SCREEN SCROLL_LOCK PAUSE INSERT HOME PAGE_UP DELETE END PAGE_DOWN "
+	b"RIGHT_ARROW LEFT_ARROW DOWN_ARROW UP_ARROW KEYPAD_NUMLOCK "
+	b"KEYPAD_FORWARD_SLASH KEYPAD_ASTERISK KEYPAD_MINUS KEYPAD_PLUS "
+	b"KEYPAD_ENTER KEYPAD_ONE KEYPAD_TWO KEYPAD_THREE KEYPAD_FOUR KEYPAD_FIVE "
+	b"KEYPAD_SIX KEYPAD_SEVEN KEYPAD_EIGHT KEYPAD_NINE KEYPAD_ZERO "
+	b"KEYPAD_PERIOD KEYPAD_BACKSLASH MENU APPLICATION POWER KEYPAD_EQUALS F13 "
+	b"F14 F15 F16 F17 F18 F19 F20 F21 F22 F23 F24 LEFT_CONTROL CONTROL "
+	b"LEFT_SHIFT SHIFT LEFT_ALT ALT OPTION LEFT_GUI GUI WINDOWS COMMAND "
+	b"RIGHT_CONTROL RIGHT_SHIFT RIGHT_ALT RIGHT_GUI "
+)
+_KEY_CODES = (
+	b"\x04\x05\x06\x07\x08\x09\x0a\x0b\x0c\x0d\x0e\x0f\x10\x11\x12\x13"
+	b"\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1e\x1f\x1f\x20\x20"
+	b"\x21\x21\x22\x22\x23\x23\x24\x24\x25\x25\x26\x26\x27\x27\x28\x28"
+	b"\x29\x2a\x2b\x2c\x2c\x2d\x2e\x2f\x30\x31\x32\x33\x34\x35\x36\x37"
+	b"\x38\x39\x3a\x3b\x3c\x3d\x3e\x3f\x40\x41\x42\x43\x44\x45\x46\x47"
+	b"\x48\x49\x4a\x4b\x4c\x4d\x4e\x4f\x50\x51\x52\x53\x54\x55\x56\x57"
+	b"\x58\x59\x5a\x5b\x5c\x5d\x5e\x5f\x60\x61\x62\x63\x64\x65\x65\x66"
+	b"\x67\x68\x69\x6a\x6b\x6c\x6d\x6e\x6f\x70\x71\x72\x73\xe0\xe0\xe1"
+	b"\xe1\xe2\xe2\xe2\xe3\xe3\xe3\xe3\xe4\xe5\xe6\xe7"
+)
+
+# consumer control keys, names and the keycodes in the same order
+_CONSUMER_NAMES = (
+	b" C_RECORD C_FAST_FORWARD C_REWIND C_SCAN_NEXT_TRACK C_SCAN_PREVIOUS_TRACK "
+	b"C_STOP C_EJECT C_PLAY_PAUSE C_MUTE C_VOLUME_DECREMENT C_VOLUME_INCREMENT "
+	b"C_BRIGHTNESS_DECREMENT C_BRIGHTNESS_INCREMENT "
+)
+_CONSUMER_CODES = (
+	b"\xb2\xb3\xb4\xb5\xb6\xb7\xb8\xcd\xe2\xea\xe9\x70\x6f"
+)
+
+# mouse buttons, names and the keycodes in the same order
+_MOUSE_NAMES = (
+	b" M_LEFT M_RIGHT M_MIDDLE "
+)
+_MOUSE_CODES = (
+	b"\x01\x02\x04"
+)
+
+
+def _find(names: bytes, codes: bytes, key: bytes) -> int:
+	i = names.find(key)
+	if i < 0:
+		return -1
+	return codes[names.count(b" ", 0, i)]
+
+
+def code(name: str):
+	# the keycode called name in keycode_helper
+	if " " not in name:
+		key = b" " + name.encode() + b" "
+		value = _find(_KEY_NAMES, _KEY_CODES, key)
+		if value >= 0:
+			return value
+		value = _find(_CONSUMER_NAMES, _CONSUMER_CODES, key)
+		if value >= 0:
+			return ConsumerCode(value)
+		value = _find(_MOUSE_NAMES, _MOUSE_CODES, key)
+		if value >= 0:
+			return MouseCode(value)
+	if name == "TRNS":
+		return TRANSPARENT
+	raise AttributeError("No keycode named %s" % name)
+
+
+def __getattr__(name: str):
+	return code(name)
@@ -0,0 +1,81 @@
+# Logging without loading adafruit_logging up front
+#
+# Messages are dropped before being formatted if their level is disabled.
+# Enabled ones are printed in adafruit_logging's default format, adafruit_logging
+# itself is only imported when a level below WARNING is set (LemonKeypad.debug)
+# or a handler is added, then everything goes through it.
+
+from micropython import const
+from time import monotonic
+
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+CRITICAL = const(50)
+
+_LEVEL_NAMES = ((CRITICAL, "CRITICAL"), (ERROR, "ERROR"), (WARNING, "WARNING"), (INFO, "INFO"), (DEBUG, "DEBUG"))
+
+_loggers = {}
+
+
+def getLogger(name: str) -> "Logger":
+	logger = _loggers.get(name)
+	if logger is None:
+		logger = _loggers[name] = Logger(name)
+	return logger
+
+
+def _level_name(level: int) -> str:
+	for value, name in _LEVEL_NAMES:
+		if level >= value:
+			return name
+	return "NOTSET"
+
+
+class Logger:
+	def __init__(self, name: str) -> None:
+		self.name = name
+		self.level = WARNING
+		self._logger = None  # the adafruit_logging logger, once loaded
+
+	def _load(self):
+		if self._logger is None:
+			import adafruit_logging
+			self._logger = adafruit_logging.getLogger(self.name)
+			self._logger.setLevel(self.level)
+		return self._logger
+
+	def setLevel(self, level: int) -> None:
+		self.level = level
+		if level < WARNING or self._logger is not None:
+			self._load().setLevel(level)
+
+	def getEffectiveLevel(self) -> int:
+		return self.level
+
+	def addHandler(self, handler) -> None:
+		self._load().addHandler(handler)
+
+	def log(self, level: int, msg: str, *args) -> None:
+		if level < self.level:
+			return
+		if self._logger is not None:
+			self._logger.log(level, msg, *args)
+		else:
+			print("%.3f: %s - %s" % (monotonic(), _level_name(level), (msg % args) if args else msg))
+
+	def debug(self, msg: str, *args) -> None:
+		self.log(DEBUG, msg, *args)
+
+	def info(self, msg: str, *args) -> None:
+		self.log(INFO, msg, *args)
+
+	def warning(self, msg: str, *args) -> None:
+		self.log(WARNING, msg, *args)
+
+	def error(self, msg: str, *args) -> None:
+		self.log(ERROR, msg, *args)
+
+	def critical(self, msg: str, *args) -> None:
+		self.log(CRITICAL, msg, *args)
@@ -0,0 +1,161 @@
+# LSM6DS3TR-C backend reading the sensor's FIFO in bulk
+#
+# Instead of one I2C transaction per property read, the sensor queues gyro and
+# accelerometer samples in its on-chip FIFO at its own data rate, and each
+# drain reads the FIFO status and all queued samples in two transactions.
+# The raw words are decoded into physical units in a single vectorized pass.
+# The gyro and acceleration properties read the sensor's output registers
+# instead, the newest sample, whether the FIFO runs or not.
+#
+# The sensor's data rates and ranges are used as they are, configure them
+# (e.g. with the adafruit_lsm6ds driver) before creating the backend:
+#   sensor = LSM6DS3TRC(i2c, 0x6a)
+#   sensor.gyro_data_rate = Rate.RATE_416_HZ
+#   imu = LSM6DSFIFO(sensor.i2c_device)
+
+from micropython import const
+from math import pi
+
+from ulab import numpy as np
+from . import log as logging
+
+logger = logging.getLogger("LemonKeypad")
+
+_CTRL1_XL = const(0x10)
+_CTRL2_G = const(0x11)
+_CTRL3_C = const(0x12)
+_FIFO_CTRL1 = const(0x06)
+_FIFO_CTRL3 = const(0x08)
+_FIFO_CTRL5 = const(0x0A)
+_OUTX_L_G = const(0x22)  # to 0x2D: the newest sample, in the FIFO order
+_FIFO_STATUS1 = const(0x3A)  # to 0x3D: unread words, flags, pattern
+_FIFO_DATA_OUT_L = const(0x3E)  # burst reads roll back here after 0x3F
+
+_IF_INC = const(0x04)
+_FIFO_MODE_BYPASS = const(0b000)
+_FIFO_MODE_CONTINUOUS = const(0b110)
+_FIFO_NO_DECIMATION = const(0b001)
+_FIFO_OVER_RUN = const(0x40)
+
+# a sample is a data set of 6 words, in the FIFO order: gyro x, y, z, accelerometer x, y, z
+_SET_WORDS = const(6)
+_SET_BYTES = const(12)
+
+# output data rate by ODR code
+_ODR_HZ = (0, 12.5, 26, 52, 104, 208, 416, 833, 1666, 3332, 6664)
+# sensitivity by FS_XL code, mg/LSB
+_ACCEL_LSB = (0.061, 0.488, 0.122, 0.244)
+# sensitivity by FS_G code, mdps/LSB
+_GYRO_LSB = (8.75, 17.5, 35.0, 70.0)
+_GYRO_125_LSB = 4.375
+_MILLI_G_TO_ACCEL = 0.00980665
+
+
+class LSM6DSFIFO:
+	def __init__(self, i2c_device, max_samples: int = 32) -> None:
+		# i2c_device: an adafruit_bus_device I2CDevice of the sensor
+		self.i2c_device = i2c_device
+		self.max_samples = max_samples  # samples decoded per drain at most
+		self._register = bytearray(2)
+		self._status = bytearray(4)
+		self._buffer = bytearray(max(max_samples, 1) * _SET_BYTES)
+		self._latest = np.zeros(_SET_WORDS)
+		self.overruns = 0  # times the FIFO filled up and dropped samples
+		self.running = False
+
+		accel_ctrl = self._read_register(_CTRL1_XL)
+		gyro_ctrl = self._read_register(_CTRL2_G)
+		# the FIFO runs at the lower of the two data rates
+		odr = min(accel_ctrl >> 4, gyro_ctrl >> 4)
+		if not 0 < odr < len(_ODR_HZ):
+			raise ValueError("Enable both the gyro and the accelerometer of the IMU first")
+		self._odr = odr
+		self.rate_hz = _ODR_HZ[odr]
+
+		# raw word to m/s^2 and rad/s, in the FIFO order
+		gyro_lsb = _GYRO_125_LSB if gyro_ctrl & 0x02 else _GYRO_LSB[(gyro_ctrl >> 2) & 0x03]
+		gyro_scale = gyro_lsb / 1000 * pi / 180
+		accel_scale = _ACCEL_LSB[(accel_ctrl >> 2) & 0x03] * _MILLI_G_TO_ACCEL
+		self._scale = np.array((gyro_scale, gyro_scale, gyro_scale, accel_scale, accel_scale, accel_scale))
+
+		self.start()
+
+	def _read_register(self, register: int) -> int:
+		buf = self._register
+		buf[0] = register
+		with self.i2c_device as i2c:
+			i2c.write_then_readinto(buf, buf, out_end=1, in_start=1)
+		return buf[1]
+
+	def _write_register(self, register: int, value: int) -> None:
+		buf = self._register
+		buf[0] = register
+		buf[1] = value
+		with self.i2c_device as i2c:
+			i2c.write(buf)
+
+	def start(self) -> None:
+		# (re)start queuing samples, anything queued before is dropped
+		self._write_register(_FIFO_CTRL5, _FIFO_MODE_BYPASS)
+		self._write_register(_CTRL3_C, self._read_register(_CTRL3_C) | _IF_INC)
+		self._write_register(_FIFO_CTRL1, 0)
+		self._write_register(_FIFO_CTRL3, (_FIFO_NO_DECIMATION << 3) | _FIFO_NO_DECIMATION)
+		self._write_register(_FIFO_CTRL5, (self._odr << 3) | _FIFO_MODE_CONTINUOUS)
+		self.running = True
+
+	def stop(self) -> None:
+		# bypass mode, the FIFO is emptied and stops queuing
+		self._write_register(_FIFO_CTRL5, _FIFO_MODE_BYPASS)
+		self.running = False
+
+	def read_into(self, out) -> int:
+		# drain the queued samples into the rows of `out' (gyro x, y, z, acceleration x, y, z),
+		# oldest first, return the number of samples
+		status = self._status
+		buf = self._register
+		with self.i2c_device as i2c:
+			buf[0] = _FIFO_STATUS1
+			i2c.write_then_readinto(buf, status, out_end=1)
+			words = status[0] | ((status[1] & 0x07) << 8)
+			if status[1] & _FIFO_OVER_RUN:
+				self.overruns += 1
+				logger.debug("IMU FIFO overrun")
+
+			# the pattern is the position in a data set of the next word
+			pattern = status[2] | ((status[3] & 0x03) << 8)
+			skip = (_SET_WORDS - pattern) % _SET_WORDS
+			if skip > words:
+				return 0
+			count = min((words - skip) // _SET_WORDS, self.max_samples, len(out))
+			if count == 0:
+				return 0
+
+			buf[0] = _FIFO_DATA_OUT_L
+			if skip:
+				# drop the rest of a partly read data set
+				i2c.write_then_readinto(buf, self._buffer, out_end=1, in_end=skip * 2)
+			i2c.write_then_readinto(buf, self._buffer, out_end=1, in_end=count * _SET_BYTES)
+
+		raw = np.frombuffer(self._buffer, dtype=np.int16, count=count * _SET_WORDS)
+		out[:count, :] = raw.reshape((count, _SET_WORDS)) * self._scale
+		return count
+
+	def _read_latest(self):
+		# for the property interface, the output registers keep the FIFO for read_into
+		buf = self._register
+		with self.i2c_device as i2c:
+			buf[0] = _OUTX_L_G
+			i2c.write_then_readinto(buf, self._buffer, out_end=1, in_end=_SET_BYTES)
+		raw = np.frombuffer(self._buffer, dtype=np.int16, count=_SET_WORDS)
+		self._latest[:] = raw * self._scale
+		return self._latest
+
+	@property
+	def gyro(self) -> tuple:
+		latest = self._read_latest()
+		return (latest[0], latest[1], latest[2])
+
+	@property
+	def acceleration(self) -> tuple:
+		latest = self._read_latest()
+		return (latest[3], latest[4], latest[5])
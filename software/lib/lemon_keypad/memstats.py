@@ -0,0 +1,123 @@
+# Heap and garbage collector statistics
+#
+# Allocations are measured as gc.mem_alloc() deltas, plus whatever the
+# collections run by LemonKeypad.collect_garbage() freed in between. A collection
+# started by the VM itself (when an allocation fails) can't be seen, except that
+# mem_alloc() goes down, so such a measurement is dropped and counted instead.
+# Measured actions may await, then the allocations of other tasks are included.
+
+from array import array
+import gc
+from time import monotonic_ns
+
+
+class MemoryStats:
+	def __init__(self, kind_names) -> None:
+		# kind_names: names of the compiled action kinds, by kind
+		self.kind_names = kind_names
+		kinds = len(kind_names)
+		self.free_low = gc.mem_free()  # least free heap seen
+		self.action_count = array("L", [0] * kinds)  # measured dispatches by action kind
+		self.action_alloc = array("L", [0] * kinds)  # bytes allocated by action kind
+		self.action_alloc_max = array("L", [0] * kinds)  # most bytes allocated by one dispatch
+		self.task_names = []  # measured user tasks
+		self.task_steps = []  # times each task was resumed
+		self.task_alloc = []  # bytes allocated by each task
+		self.task_alloc_max = []  # most bytes allocated by one step
+		self.gc_count = 0  # collections run by collect()
+		self.gc_total_us = 0
+		self.gc_max_us = 0
+		self.gc_freed = 0  # bytes freed by collect()
+		self.unseen_gc_count = 0  # measurements dropped because the VM collected meanwhile
+
+	def check_free(self) -> int:
+		free = gc.mem_free()
+		if free < self.free_low:
+			self.free_low = free
+		return free
+
+	def collect(self) -> None:
+		# the heap is the fullest right before a collection
+		self.check_free()
+		before = gc.mem_alloc()
+		start = monotonic_ns()
+		gc.collect()
+		pause_us = (monotonic_ns() - start) // 1000
+		self.gc_freed += before - gc.mem_alloc()
+		self.gc_count += 1
+		self.gc_total_us += pause_us
+		if pause_us > self.gc_max_us:
+			self.gc_max_us = pause_us
+
+	def allocated_since(self, mem_alloc: int, gc_freed: int) -> int:
+		# bytes allocated since mem_alloc and gc_freed were read, -1 if unknown
+		allocated = gc.mem_alloc() - mem_alloc + self.gc_freed - gc_freed
+		if allocated < 0:
+			self.unseen_gc_count += 1
+			return -1
+		return allocated
+
+	def record_action(self, kind: int, mem_alloc: int, gc_freed: int) -> None:
+		allocated = self.allocated_since(mem_alloc, gc_freed)
+		self.check_free()
+		if allocated < 0:
+			return
+		self.action_count[kind] += 1
+		self.action_alloc[kind] += allocated
+		if allocated > self.action_alloc_max[kind]:
+			self.action_alloc_max[kind] = allocated
+
+	def measure_task(self, name: str, coro):
+		# wrap a coroutine, the allocations of each step of it are recorded
+		index = len(self.task_names)
+		self.task_names.append(name)
+		self.task_steps.append(0)
+		self.task_alloc.append(0)
+		self.task_alloc_max.append(0)
+		return self._measured_steps(index, coro)
+
+	def _measured_steps(self, index: int, coro):
+		exc = None
+		while True:
+			mem_alloc = gc.mem_alloc()
+			gc_freed = self.gc_freed
+			try:
+				if exc is None:
+					value = coro.send(None)
+				else:
+					value = coro.throw(exc)
+			except StopIteration as e:
+				return e.value
+			finally:
+				allocated = self.allocated_since(mem_alloc, gc_freed)
+				self.task_steps[index] += 1
+				if allocated > 0:
+					self.task_alloc[index] += allocated
+					if allocated > self.task_alloc_max[index]:
+						self.task_alloc_max[index] = allocated
+			exc = None
+			try:
+				yield value
+			except GeneratorExit:
+				coro.close()
+				raise
+			except BaseException as e:  # pylint: disable=broad-except
+				exc = e  # e.g. cancelled, pass it on
+
+	def report(self) -> str:
+		lines = [
+			"heap: %d free, %d allocated, %d least free" % (gc.mem_free(), gc.mem_alloc(), self.free_low),
+			"gc: %d collections, %d us max, %d us avg, %d bytes freed, %d unseen" % (
+				self.gc_count, self.gc_max_us, self.gc_total_us // self.gc_count if self.gc_count else 0,
+				self.gc_freed, self.unseen_gc_count),
+		]
+		for kind, name in enumerate(self.kind_names):
+			count = self.action_count[kind]
+			if count:
+				lines.append("action %s: %d dispatches, %d bytes avg, %d bytes max" % (
+					name, count, self.action_alloc[kind] // count, self.action_alloc_max[kind]))
+		for index, name in enumerate(self.task_names):
+			steps = self.task_steps[index]
+			lines.append("task %s: %d steps, %d bytes, %d bytes max per step" % (
+				name, steps, self.task_alloc[index], self.task_alloc_max[index]))
+		return "\n".join(lines)
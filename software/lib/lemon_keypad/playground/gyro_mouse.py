@@ -1,7 +1,9 @@
 import asyncio
 import math
-from ulab.numpy.linalg import norm
-from lemon_keypad.keycode_helper import M_LEFT, M_RIGHT, M_MIDDLE
+from array import array
+from supervisor import ticks_ms
+from lemon_keypad.keycodes import M_LEFT, M_RIGHT, M_MIDDLE
+from lemon_keypad.timer import ticks_add, ticks_diff
 
 try:
 	from lemon_keypad import LemonKeypad
@@ -9,65 +11,94 @@ except ImportError:
 	pass
 
 
+# one pointer update per HID poll of the host, CircuitPython's HID endpoint is polled every 8 ms
+FRAME_MS = 8
+
+# pointer counts per frame for 1 rad/s, before sensitivity and acceleration
+GAIN = 10
+
+# dynamic acceleration by angular speed: log(speed + 1), clamped to 1-40
+# precomputed in steps of 1/ACCEL_STEPS rad/s up to 32 rad/s, faster turns use the last entry
+ACCEL_STEPS = 16
+ACCEL_LUT = array("f", (min(40, max(1, math.log(i / ACCEL_STEPS + 1))) for i in range(ACCEL_STEPS * 32)))
+
+
 async def gyro_mouse(dev: LemonKeypad):
 
 	# set pixels, indicated program is running
 
-	dev.pixels.fill((0, 0x16, 0x16))
-	imu = dev.imu
+	dev.animator.fill((0, 0x16, 0x16))
+	imu = dev.imu_sampler
 	event_queue = dev.key_scanner.events
 
 	sensitivity = 1.5
 
-	while True:
-		await asyncio.sleep(0)
-
-		new_event = event_queue.get()
-		if new_event is not None:
-			# make mouse key inputs
-			if new_event.pressed:
-				if new_event.key_number == 4:
-					await dev.trigger_key_press_action(M_LEFT)
-				elif new_event.key_number == 3:
-					await dev.trigger_key_press_action(M_MIDDLE)
-				elif new_event.key_number == 2:
-					await dev.trigger_key_press_action(M_RIGHT)
-				elif new_event.key_number == 1:
-					# increase sensitivity
-					sensitivity += 0.1
-					sensitivity = min(3, sensitivity)
-				elif new_event.key_number == 5:
-					# decrease sensitivity
-					sensitivity -= 0.1
-					sensitivity = max(0.3, sensitivity)
-				elif new_event.key_number == 0:
-					# clear pixels and quit
-					dev.pixels.fill((0, 0, 0))
-					return
-			else:
-				if new_event.key_number == 4:
-					await dev.trigger_key_release_action(M_LEFT)
-				elif new_event.key_number == 3:
-					await dev.trigger_key_release_action(M_MIDDLE)
-				elif new_event.key_number == 2:
-					await dev.trigger_key_release_action(M_RIGHT)
-
-		# The gyro only gives angular rates, not absolute values to original position
-		dx, _, dz = imu.gyro
-
-		# linear values
-		# mouse_x = -dz * 10 * sensitivity
-		# mouse_y = -dx * 10 * sensitivity
-
-		# dynamic accleration, log
-		# ensure x y acceleration same
-		accel = math.log(abs(norm((dz, dx))) + 1)
-		# clamp
-		accel = min(40, accel)
-		accel = max(1, accel)
-		mouse_x = -dz * 10 * sensitivity * accel
-		mouse_y = -dx * 10 * sensitivity * accel
-
-		dev.move_mouse(int(mouse_x), int(mouse_y))
-
-		# print("dz: %.2f, dx: %.2f, mouse_x: %.2f, mouse_y: %.2f, accel: %.2f, sensitivity: %.2f" % (dz, dx, mouse_x, mouse_y, accel, sensitivity))
+	# movement below one count is carried over to the next frames
+	remainder_x = 0.0
+	remainder_y = 0.0
+	last_index = len(ACCEL_LUT) - 1
+
+	imu.subscribe()
+	try:
+		next_tick = ticks_ms()
+		while True:
+			# fixed frame rate, frames missed while busy are skipped
+			next_tick = ticks_add(next_tick, FRAME_MS)
+			delay = ticks_diff(next_tick, ticks_ms())
+			if delay < 0:
+				next_tick = ticks_ms()
+				delay = 0
+			await asyncio.sleep_ms(delay)
+
+			new_event = event_queue.get()
+			if new_event is not None:
+				# make mouse key inputs
+				if new_event.pressed:
+					if new_event.key_number == 4:
+						await dev.trigger_key_press_action(M_LEFT)
+					elif new_event.key_number == 3:
+						await dev.trigger_key_press_action(M_MIDDLE)
+					elif new_event.key_number == 2:
+						await dev.trigger_key_press_action(M_RIGHT)
+					elif new_event.key_number == 1:
+						# increase sensitivity
+						sensitivity += 0.1
+						sensitivity = min(3, sensitivity)
+					elif new_event.key_number == 5:
+						# decrease sensitivity
+						sensitivity -= 0.1
+						sensitivity = max(0.3, sensitivity)
+					elif new_event.key_number == 0:
+						# clear pixels and quit
+						dev.animator.fill((0, 0, 0))
+						return
+				else:
+					if new_event.key_number == 4:
+						await dev.trigger_key_release_action(M_LEFT)
+					elif new_event.key_number == 3:
+						await dev.trigger_key_release_action(M_MIDDLE)
+					elif new_event.key_number == 2:
+						await dev.trigger_key_release_action(M_RIGHT)
+
+			# The gyro only gives angular rates, not absolute values to original position
+			dx, _, dz = imu.gyro
+
+			# ensure x y acceleration same
+			index = int(math.sqrt(dz * dz + dx * dx) * ACCEL_STEPS)
+			accel = ACCEL_LUT[index if index < last_index else last_index]
+			scale = GAIN * sensitivity * accel
+			remainder_x -= dz * scale
+			remainder_y -= dx * scale
+
+			# whole counts only, int() truncates toward zero
+			mouse_x = int(remainder_x)
+			mouse_y = int(remainder_y)
+			if mouse_x == 0 and mouse_y == 0:
+				continue
+			remainder_x -= mouse_x
+			remainder_y -= mouse_y
+			dev.move_mouse(mouse_x, mouse_y)
+
+			# print("dz: %.2f, dx: %.2f, mouse_x: %d, mouse_y: %d, accel: %.2f, sensitivity: %.2f" % (dz, dx, mouse_x, mouse_y, accel, sensitivity))
+	finally:
+		imu.unsubscribe()
@@ -1,8 +1,17 @@
 # Here we have implemented some example user functions
+#
+# level_gauge is also the reference for user functions that run for a long
+# time: everything is allocated before the loop, and each frame only updates
+# preallocated buffers in place, so it doesn't keep the garbage collector busy
+# (a collection pauses key processing too).
 import os
-import asyncio
 import math
+import asyncio
+from keypad import Event
+from supervisor import ticks_ms
 from ulab import numpy as np
+from lemon_keypad.imu import ACCEL_X, ACCEL_Y
+from lemon_keypad.timer import ticks_add, ticks_diff
 
 try:
 	from lemon_keypad import LemonKeypad
@@ -10,54 +19,89 @@ except ImportError:
 	pass
 
 
+# the gauge shows green while tilted less than this, in m/s^2
+LEVEL_THRESHOLD = 0.27
+# brightness of the colors
+LEVEL = 0x40
+
+
 async def level_gauge(dev: LemonKeypad):
-	imu = dev.imu
-	pixels = dev.pixels
+	imu = dev.imu_sampler
+	pixels = dev.animator
 
 	if imu is None or pixels is None:
 		return
 
 	event_queue = dev.key_scanner.events
+	event = Event()
 
-	led_positions = np.array([
-		(np.cos((i * 360/pixels.n + 90) / 180 * math.pi), np.sin((i * 360/pixels.n + 90) / 180 * math.pi)) for i in range(pixels.n, 0, -1)
-	])
+	# unit vectors of the LEDs on the ring
+	n = pixels.n
+	led_x = np.array([math.cos((i * 360 / n + 90) / 180 * math.pi) for i in range(n, 0, -1)])
+	led_y = np.array([math.sin((i * 360 / n + 90) / 180 * math.pi) for i in range(n, 0, -1)])
+	# per LED share of the tilt direction, then scratch
+	factors = np.zeros(n)
+	scratch = np.zeros(n)
 
-	red = np.array((0x40, 0, 0))
-	green = np.array((0, 0x40, 0))
-	blue = np.array((0, 0, 0x40))
-
-	imu_comp_vector = np.array((0, 0, 0))
+	comp_x = comp_y = 0.0
 	if (comp := os.getenv("imu_accel_comp_x")):
-		imu_comp_vector[0] = comp * 0.0001
+		comp_x = comp * 0.0001
 	if (comp := os.getenv("imu_accel_comp_y")):
-		imu_comp_vector[1] = comp * 0.0001
-	if (comp := os.getenv("imu_accel_comp_z")):
-		imu_comp_vector[2] = comp * 0.0001
-
-	x_base = 0
-	y_base = 0
-
-	while True:
-		await asyncio.sleep(0)
-
-		new_event = event_queue.get()
-		if new_event is not None and new_event.pressed:
-			if new_event.key_number == 0:
-				x_base, y_base, _ = imu_comp_vector + imu.acceleration
-			else:
-				# clear and quit
-				pixels.fill((0, 0, 0))
-				break
-
-		x1, y1, z1 = imu_comp_vector + imu.acceleration
-		platform_vector = np.array((x1-x_base, y1-y_base))
-		length = np.linalg.norm(platform_vector)
-		if length < 0.27:
-			pixels.fill(green.tolist())
-			continue
-		unit_vector = platform_vector / length
-		factors = np.dot(led_positions, unit_vector)
-		factors = np.array([factors]).transpose()
-		colors = factors * red + (1 - factors) * blue
-		pixels[:] = colors.tolist()
+		comp_y = comp * 0.0001
+
+	x_base = 0.0
+	y_base = 0.0
+
+	# no need to redraw faster than the LEDs are updated
+	frame_ms = pixels.period_ms
+	samples = imu.samples
+
+	imu.subscribe()
+	try:
+		next_tick = ticks_ms()
+		while True:
+			next_tick = ticks_add(next_tick, frame_ms)
+			delay = ticks_diff(next_tick, ticks_ms())
+			if delay < 0:
+				next_tick = ticks_ms()
+				delay = 0
+			await asyncio.sleep_ms(delay)
+
+			row = imu.latest_index
+			if row < 0:
+				continue
+			x1 = samples[row, ACCEL_X] + comp_x
+			y1 = samples[row, ACCEL_Y] + comp_y
+
+			if event_queue.get_into(event) and event.pressed:
+				if event.key_number == 0:
+					x_base = x1
+					y_base = y1
+				else:
+					# clear and quit
+					pixels.fill(0)
+					break
+
+			x1 -= x_base
+			y1 -= y_base
+			length = math.sqrt(x1 * x1 + y1 * y1)
+			if length < LEVEL_THRESHOLD:
+				pixels.fill(LEVEL << 8)
+				continue
+
+			# factors = led_x * ux + led_y * uy, in place
+			factors *= 0.0
+			factors += led_x
+			factors *= x1 / length
+			scratch *= 0.0
+			scratch += led_y
+			scratch *= y1 / length
+			factors += scratch
+
+			# red towards the tilt, blue away from it
+			for i in range(n):
+				factor = factors[i]
+				red = int(LEVEL * factor) if factor > 0 else 0
+				pixels[i] = (red << 16) | int(LEVEL * (1 - factor))
+	finally:
+		imu.unsubscribe()
@@ -0,0 +1,36 @@
+# Startup phase timer
+#
+# Records the time and the free heap at the end of each startup phase, to see
+# where boot time and memory go. Times are since power on (time.monotonic_ns),
+# so the first phase covers boot.py and everything code.py did before
+# importing lemon_keypad.
+
+import gc
+from time import monotonic_ns
+
+
+class StartupTimer:
+	def __init__(self) -> None:
+		self.phases = []  # phase name, in order
+		self.times_ms = []  # when each phase ended
+		self.mem_free = []  # free heap when each phase ended
+		self.mark("boot")
+
+	def mark(self, phase: str) -> None:
+		# end a phase, only the first time it ends
+		if phase in self.phases:
+			return
+		self.phases.append(phase)
+		self.times_ms.append(monotonic_ns() // 1_000_000)
+		self.mem_free.append(gc.mem_free())
+
+	def report(self) -> str:
+		lines = ["startup: %d ms, %d bytes free" % (self.times_ms[-1], self.mem_free[-1])]
+		last_ms = 0
+		last_free = None
+		for i, phase in enumerate(self.phases):
+			used = "" if last_free is None else ", %d bytes used" % (last_free - self.mem_free[i])
+			lines.append("  %-16s %6d ms%s" % (phase, self.times_ms[i] - last_ms, used))
+			last_ms = self.times_ms[i]
+			last_free = self.mem_free[i]
+		return "\n".join(lines)
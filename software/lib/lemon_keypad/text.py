@@ -0,0 +1,102 @@
+# Background text output
+#
+# Strings are typed by a task of their own, one report per step, so the
+# event loop keeps running while a long string goes out. A key pressed
+# meanwhile either aborts the text or waits for it, see LemonKeypad.text_mode.
+# Strings are translated to keycodes once, when the keymap is compiled.
+
+from micropython import const
+import asyncio
+
+from . import log as logging
+
+logger = logging.getLogger("LemonKeypad")
+
+# what a key press does to the text being typed
+TEXT_QUEUE = const(0)  # the key is processed after the text is done
+TEXT_ABORT = const(1)  # the text is stopped and the key is processed immediately
+
+_LEFT_SHIFT = const(0xE1)
+
+
+def compile_text(text: str) -> bytearray:
+	# translate a string to (modifier, keycode) pairs, modifier is 0 if not needed
+	from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS  # only needed with strings in the keymap
+	table = KeyboardLayoutUS.ASCII_TO_KEYCODE
+	shift_flag = KeyboardLayoutUS.SHIFT_FLAG
+	codes = bytearray(2 * len(text))
+	i = 0
+	for char in text:
+		value = ord(char)
+		keycode = table[value] if value < len(table) else 0
+		if keycode == 0:
+			raise ValueError("unsupported character %r in string %r" % (char, text))
+		if keycode & shift_flag:
+			codes[i] = _LEFT_SHIFT
+			keycode &= ~shift_flag
+		codes[i + 1] = keycode
+		i += 2
+	return codes
+
+
+class TextStreamer:
+	def __init__(self, keypad) -> None:
+		self.keypad = keypad
+		self.pending = []  # strings waiting to be typed, in order
+		self.task = None
+		self.done = asyncio.Event()
+		self.done.set()
+
+	def busy(self) -> bool:
+		return self.task is not None
+
+	def write(self, codes: bytearray) -> None:
+		# codes: a string compiled by compile_text
+		self.pending.append(codes)
+		if self.task is None:
+			self.done.clear()
+			self.task = asyncio.create_task(self.stream())
+
+	def abort(self) -> None:
+		self.pending.clear()
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+			self.keypad.release_all_hid()
+			self.done.set()
+
+	async def wait(self) -> None:
+		await self.done.wait()
+
+	async def stream(self) -> None:
+		keypad = self.keypad
+		pending = self.pending
+		# each character takes a press and a release report
+		rate = keypad.text_rate_cps
+		interval_ms = 500 // rate if rate > 0 else 0
+		try:
+			keypad.release_all_hid()
+			while pending:
+				codes = pending.pop(0)
+				for i in range(0, len(codes), 2):
+					modifier = codes[i]
+					keycode = codes[i + 1]
+					if modifier:
+						keypad.press_kbd_key(modifier, keycode)
+					else:
+						keypad.press_kbd_key(keycode)
+					await asyncio.sleep_ms(interval_ms)
+					if modifier:
+						keypad.release_kbd_key(modifier, keycode)
+					else:
+						keypad.release_kbd_key(keycode)
+					await asyncio.sleep_ms(interval_ms)
+		except Exception as e:  # pylint: disable=broad-except
+			logger.debug("Text output stopped: %s: %s", e.__class__.__name__, e)
+			pending.clear()
+			keypad.release_all_hid()
+		finally:
+			# an aborted stream has been cleaned up by abort()
+			if self.task is asyncio.current_task():
+				self.task = None
+				self.done.set()
@@ -0,0 +1,98 @@
+# Deadline scheduler for pending key decisions
+#
+# Each key owns at most one deadline slot. The armed slots are kept packed in
+# an array with the position of each key beside it, so arming and cancelling
+# are a few array writes (a cancelled slot is replaced by the last one). The
+# earliest deadline is cached, and only recomputed (by walking the armed
+# slots, not all keys) after the cached one is cancelled, moved or fired.
+# Deadlines are supervisor.ticks_ms() values, which wrap around every 2**29 ms,
+# so they are only compared with ticks_diff.
+
+from array import array
+from micropython import const
+
+_TICKS_PERIOD = const(1 << 29)
+_TICKS_MAX = const(_TICKS_PERIOD - 1)
+_TICKS_HALFPERIOD = const(_TICKS_PERIOD // 2)
+
+
+def ticks_add(ticks: int, delta: int) -> int:
+	return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1: int, ticks2: int) -> int:
+	# signed ticks1 - ticks2, valid while they are less than half a period apart
+	diff = (ticks1 - ticks2) & _TICKS_MAX
+	return ((diff + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+class DeadlineTimer:
+	def __init__(self, count: int) -> None:
+		self.deadlines = array("l", [0] * count)
+		self.armed_indexes = array("H", [0] * count)  # the armed keys, first armed_count entries
+		self.positions = array("h", [-1] * count)  # position in armed_indexes, -1 if not armed
+		self.armed_count = 0
+		self._earliest_index = -1
+		self._dirty = False
+
+	def arm(self, index: int, deadline: int) -> None:
+		if self.positions[index] < 0:
+			self.positions[index] = self.armed_count
+			self.armed_indexes[self.armed_count] = index
+			self.armed_count += 1
+		elif index == self._earliest_index:
+			self._dirty = True
+		self.deadlines[index] = deadline
+		if (not self._dirty
+				and (self._earliest_index < 0 or ticks_diff(deadline, self.deadlines[self._earliest_index]) < 0)):
+			self._earliest_index = index
+
+	def cancel(self, index: int) -> None:
+		position = self.positions[index]
+		if position < 0:
+			return
+		self.positions[index] = -1
+		self.armed_count -= 1
+		if position != self.armed_count:
+			# the last armed key takes the freed place
+			last = self.armed_indexes[self.armed_count]
+			self.armed_indexes[position] = last
+			self.positions[last] = position
+		if index == self._earliest_index:
+			self._earliest_index = -1
+			self._dirty = self.armed_count > 0
+
+	def clear(self) -> None:
+		for i in range(self.armed_count):
+			self.positions[self.armed_indexes[i]] = -1
+		self.armed_count = 0
+		self._earliest_index = -1
+		self._dirty = False
+
+	def _earliest(self) -> int:
+		if self._dirty:
+			self._dirty = False
+			earliest = -1
+			deadlines = self.deadlines
+			armed_indexes = self.armed_indexes
+			for j in range(self.armed_count):
+				i = armed_indexes[j]
+				if earliest < 0 or ticks_diff(deadlines[i], deadlines[earliest]) < 0:
+					earliest = i
+			self._earliest_index = earliest
+		return self._earliest_index
+
+	def next_deadline(self):
+		# the earliest armed deadline, None if nothing is armed
+		index = self._earliest()
+		if index < 0:
+			return None
+		return self.deadlines[index]
+
+	def pop_due(self, now: int) -> int:
+		# disarm and return the index of a deadline not later than `now', -1 if none is due
+		index = self._earliest()
+		if index < 0 or ticks_diff(self.deadlines[index], now) > 0:
+			return -1
+		self.cancel(index)
+		return index
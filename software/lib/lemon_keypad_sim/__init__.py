@@ -0,0 +1,155 @@
+# Host side simulator for lemon keypad
+#
+# Runs the real LemonKeypad under CPython with stand-ins for the CircuitPython
+# only modules, driven by a virtual clock. Pure Python CircuitPython libraries
+# (adafruit_hid, adafruit_logging) are used as is, install them with pip:
+#   pip install adafruit-circuitpython-hid adafruit-circuitpython-logging
+# ulab is stood in by numpy, install it too to simulate the IMU.
+#
+# The stand-ins are installed by Simulator() or install(), lemon_keypad can only
+# be imported on a host after that.
+# NOTE: this replaces `asyncio' and `gc' in sys.modules, run the simulator in its own process.
+#
+# Example:
+#   from lemon_keypad_sim import Simulator
+#   sim = Simulator()
+#   from lemon_keypad.keycodes import A, B, C, D, E, F
+#   sim.keypad.keymap = {0: [A, B, C, D, E, F]}
+#   sim.tap(0, at_ms=10)
+#   sim.run(until_ms=100)
+#   print(sim.reports)
+
+import sys
+
+from .clock import clock
+
+# module name -> stand-in submodule
+_FAKE_MODULES = (
+	"micropython",
+	"microcontroller",
+	"watchdog",
+	"supervisor",
+	"keypad",
+	"usb_hid",
+	"neopixel",
+	"board",
+	"asyncio",
+	"gc",
+)
+
+# virtual CPU time consumed each time a task is resumed
+DEFAULT_STEP_COST_US = 50
+
+
+class NativeTuple(tuple):
+	# MicroPython builds a tuple subclass from the arguments passed to
+	# super().__init__(), CPython builds it in __new__ from the constructor
+	# arguments. Subclass this instead of tuple to support both.
+	def __new__(cls, *args, **kwargs):
+		return tuple.__new__(cls, args)
+
+	def __init__(self, *args, **kwargs) -> None:
+		pass
+
+
+def installed() -> bool:
+	return getattr(sys.modules.get("asyncio"), "__name__", "") == __name__ + ".asyncio"
+
+
+def install() -> None:
+	# replaces the CircuitPython only modules (and asyncio, gc) for the whole process
+	if installed():
+		return
+	for name in _FAKE_MODULES:
+		module = __import__(__name__ + "." + name, None, None, ["*"])
+		sys.modules[name] = module
+	try:
+		from . import ulab
+	except ImportError:
+		pass  # numpy isn't installed, the IMU can't be simulated
+	else:
+		sys.modules["ulab"] = ulab
+		sys.modules["ulab.numpy"] = ulab.numpy
+		sys.modules["ulab.numpy.linalg"] = ulab.numpy.linalg
+
+
+class Simulator:
+	def __init__(self, key_count: int = 6, *, step_cost_us: int = DEFAULT_STEP_COST_US, start_ticks_ms: int = 0,
+			trace_memory: bool = False) -> None:
+		install()
+		if trace_memory:
+			# gc.mem_alloc() and gc.mem_free() report the traced memory
+			import tracemalloc
+			tracemalloc.start()
+		import asyncio
+		import usb_hid
+		from microcontroller import Pin
+		from lemon_keypad import LemonKeypad
+
+		clock.reset(start_ticks_ms)
+		usb_hid.clear_reports()
+		self.loop = asyncio.new_loop(step_cost_us)
+		self.loop.sources.append(self)
+
+		self.keypad = LemonKeypad()
+		self.keypad.keys = [Pin("K%d" % i) for i in range(key_count)]
+
+		self._trace = []  # (time in us, key number, pressed), sorted
+		self._trace_index = 0
+		self._main = None
+
+	### Key event scripting ###
+
+	def press(self, key: int, at_ms: float) -> None:
+		self._add_event(at_ms, key, True)
+
+	def release(self, key: int, at_ms: float) -> None:
+		self._add_event(at_ms, key, False)
+
+	def tap(self, key: int, at_ms: float, hold_ms: float = 30) -> None:
+		self.press(key, at_ms)
+		self.release(key, at_ms + hold_ms)
+
+	def replay(self, trace) -> None:
+		# trace: iterable of (time in ms, key number, pressed)
+		for at_ms, key, pressed in trace:
+			self._add_event(at_ms, key, pressed)
+
+	def _add_event(self, at_ms: float, key: int, pressed: bool) -> None:
+		self._trace.append((round(at_ms * 1000), key, pressed))
+		self._trace.sort(key=lambda e: e[0])
+
+	# event source interface used by the simulated event loop
+
+	def next_us(self):
+		if self._trace_index >= len(self._trace) or self.keypad.key_scanner is None:
+			return None
+		return self._trace[self._trace_index][0]
+
+	def deliver(self) -> None:
+		# the real scanner runs in the background, events are stamped with the time they happened
+		at_us, key, pressed = self._trace[self._trace_index]
+		self._trace_index += 1
+		self.keypad.key_scanner._sim_event(key, pressed, clock.ticks_ms_at(at_us))
+
+	### Running ###
+
+	def run(self, until_ms: float) -> None:
+		if self._main is None:
+			self._main = self.loop.create_task(self.keypad.run_async())
+		self.loop.run_until(int(until_ms * 1000))
+		if self.loop.errors:
+			raise self.loop.errors[0]
+
+	@property
+	def now_ms(self) -> float:
+		return clock.now_ms
+
+	@property
+	def reports(self) -> list:
+		# (time in ms, device name, report bytes)
+		import usb_hid
+		return [(t / 1000, name, report) for t, name, report in usb_hid.reports]
+
+	def device_reports(self, name: str) -> list:
+		return [(t, report) for t, n, report in self.reports if n == name]
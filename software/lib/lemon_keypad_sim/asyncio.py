@@ -0,0 +1,321 @@
+# A tiny asyncio stand-in that runs on the virtual clock
+#
+# Only the subset used by lemon_keypad is provided. Just like CircuitPython's
+# asyncio, awaitables park the current task somewhere (timer heap, IO queue,
+# event, another task) and then do a bare `yield'.
+# Every resumed step costs `step_cost_us' of virtual time, so busy loops
+# consume time just like they do on the real MCU.
+
+import heapq
+import sys
+import traceback
+from collections import deque
+
+from .clock import clock
+
+
+class CancelledError(BaseException):
+	pass
+
+
+class TimeoutError(Exception):
+	pass
+
+
+class _Yield:
+	def __await__(self):
+		yield
+
+
+_yield = _Yield()
+
+
+class Task:
+	def __init__(self, coro, loop) -> None:
+		if not hasattr(coro, "send"):
+			raise TypeError("coroutine expected")
+		self.coro = coro
+		self.loop = loop
+		self.name = getattr(coro, "__qualname__", coro.__class__.__name__)
+		self.data = None  # container this task is parked in, if any
+		self.token = 0  # bumped on each wake, invalidates stale timers
+		self.queued = False
+		self.throw = None
+		self.finished = False
+		self.result = None
+		self.exception = None
+		self.waiting = []
+		self.steps = 0
+
+	def done(self) -> bool:
+		return self.finished
+
+	def cancel(self) -> bool:
+		return self.loop.cancel(self)
+
+	def __await__(self):
+		if not self.finished:
+			self.loop.park(self.loop.current, self.waiting)
+			yield
+		if self.exception is not None:
+			raise self.exception
+		return self.result
+
+	__iter__ = __await__
+
+
+class Loop:
+	def __init__(self, step_cost_us: int = 0) -> None:
+		self.step_cost_us = step_cost_us
+		self.runq = deque()
+		self.timers = []
+		self.timer_seq = 0
+		self.io_waiting = []
+		self.sources = []
+		self.tasks = []
+		self.errors = []
+		self.current = None
+		self.steps = 0
+
+	def create_task(self, coro) -> Task:
+		task = Task(coro, self)
+		self.tasks.append(task)
+		self._enqueue(task)
+		return task
+
+	def _enqueue(self, task) -> None:
+		if not task.queued:
+			task.queued = True
+			self.runq.append(task)
+
+	def park(self, task, container) -> None:
+		task.data = container
+		if container is not None:
+			container.append(task)
+
+	def add_timer(self, task, when_us: int) -> None:
+		self.timer_seq += 1
+		heapq.heappush(self.timers, (when_us, self.timer_seq, task.token, task))
+		if task.data is None:
+			task.data = self.timers
+
+	def wake(self, task, exc=None) -> None:
+		container = task.data
+		if container is not None and container is not self.timers:
+			if container is self.io_waiting:
+				for i, (_, t) in enumerate(container):
+					if t is task:
+						del container[i]
+						break
+			elif task in container:
+				container.remove(task)
+		task.data = None
+		task.token += 1
+		if exc is not None:
+			task.throw = exc
+		self._enqueue(task)
+
+	def cancel(self, task) -> bool:
+		if task.finished:
+			return False
+		if task is self.current:
+			raise RuntimeError("can't cancel self")
+		self.wake(task, CancelledError())
+		return True
+
+	def _finish(self, task, result, exc) -> None:
+		task.finished = True
+		task.result = result
+		task.exception = exc
+		if exc is not None and not isinstance(exc, CancelledError) and not task.waiting:
+			self.errors.append(exc)
+			print("Task exception wasn't retrieved: %s" % task.name, file=sys.stderr)
+			traceback.print_exception(type(exc), exc, exc.__traceback__)
+		for waiter in task.waiting[:]:
+			self.wake(waiter)
+
+	def _step(self, task) -> None:
+		task.queued = False
+		exc = task.throw
+		task.throw = None
+		self.current = task
+		task.steps += 1
+		self.steps += 1
+		try:
+			if exc is not None:
+				task.coro.throw(exc)
+			else:
+				task.coro.send(None)
+		except StopIteration as e:
+			self._finish(task, e.value, None)
+		except BaseException as e:  # pylint: disable=broad-except
+			self._finish(task, None, e)
+		else:
+			if task.data is None:
+				self._enqueue(task)
+		finally:
+			self.current = None
+			clock.advance(self.step_cost_us)
+
+	def _next_source_us(self):
+		nxt = None
+		for source in self.sources:
+			t = source.next_us()
+			if t is not None and (nxt is None or t < nxt):
+				nxt = t
+		return nxt
+
+	def _poll(self) -> None:
+		now = clock.now_us
+		for source in self.sources:
+			while True:
+				t = source.next_us()
+				if t is None or t > now:
+					break
+				source.deliver()
+		timers = self.timers
+		while timers and timers[0][0] <= now:
+			_, _, token, task = heapq.heappop(timers)
+			if token == task.token and not task.finished:
+				self.wake(task)
+		for obj, task in self.io_waiting[:]:
+			if len(obj):
+				self.wake(task)
+
+	def run_until(self, end_us=None, main=None) -> None:
+		while True:
+			if main is not None and main.finished:
+				return
+			if end_us is not None and clock.now_us >= end_us:
+				return
+			self._poll()
+			if self.runq:
+				self._step(self.runq.popleft())
+				continue
+			# idle, jump to the next thing to happen
+			nxt = self._next_source_us()
+			while self.timers and self.timers[0][2] != self.timers[0][3].token:
+				heapq.heappop(self.timers)  # drop stale timers
+			if self.timers and (nxt is None or self.timers[0][0] < nxt):
+				nxt = self.timers[0][0]
+			if nxt is None:
+				return  # nothing will ever happen again
+			if end_us is not None and nxt > end_us:
+				clock.advance_to(end_us)
+				return
+			clock.advance_to(nxt)
+
+
+_loop = Loop()
+
+
+def new_loop(step_cost_us: int = 0) -> Loop:
+	global _loop
+	_loop = Loop(step_cost_us)
+	return _loop
+
+
+def get_loop() -> Loop:
+	return _loop
+
+
+class _IOQueue:
+	def queue_read(self, s) -> None:
+		task = _loop.current
+		task.data = _loop.io_waiting
+		_loop.io_waiting.append((s, task))
+
+	queue_write = queue_read
+
+	def remove(self, task) -> None:
+		_loop.wake(task)
+
+
+class _Core:
+	_io_queue = _IOQueue()
+
+
+core = _Core()
+
+
+class Event:
+	def __init__(self) -> None:
+		self.state = False
+		self.waiting = []
+
+	def is_set(self) -> bool:
+		return self.state
+
+	def set(self) -> None:
+		self.state = True
+		for task in self.waiting[:]:
+			_loop.wake(task)
+
+	def clear(self) -> None:
+		self.state = False
+
+	async def wait(self) -> bool:
+		if not self.state:
+			_loop.park(_loop.current, self.waiting)
+			await _yield
+		return True
+
+
+def create_task(coro) -> Task:
+	return _loop.create_task(coro)
+
+
+def current_task() -> Task:
+	return _loop.current
+
+
+async def sleep_ms(t) -> None:
+	if t > 0:
+		_loop.add_timer(_loop.current, clock.now_us + int(t * 1000))
+	await _yield
+
+
+async def sleep(t) -> None:
+	await sleep_ms(t * 1000)
+
+
+async def wait_for(aw, timeout):
+	task = aw if isinstance(aw, Task) else create_task(aw)
+	if timeout is None:
+		return await task
+	if not task.finished:
+		cur = _loop.current
+		_loop.park(cur, task.waiting)
+		_loop.add_timer(cur, clock.now_us + int(timeout * 1000000))
+		await _yield
+	if not task.finished:
+		task.cancel()
+		raise TimeoutError
+	if task.exception is not None:
+		raise task.exception
+	return task.result
+
+
+async def wait_for_ms(aw, timeout):
+	return await wait_for(aw, None if timeout is None else timeout / 1000)
+
+
+async def gather(*aws, return_exceptions=False):
+	results = []
+	for aw in aws:
+		task = aw if isinstance(aw, Task) else create_task(aw)
+		try:
+			results.append(await task)
+		except Exception as e:  # pylint: disable=broad-except
+			if not return_exceptions:
+				raise
+			results.append(e)
+	return results
+
+
+def run(coro):
+	task = create_task(coro)
+	_loop.run_until(main=task)
+	if task.exception is not None:
+		raise task.exception
+	return task.result
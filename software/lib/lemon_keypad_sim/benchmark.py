@@ -0,0 +1,222 @@
+# Key event to HID report latency benchmark
+#
+# Replays scripted key traces through LemonKeypad in the simulator and
+# matches them with the captured HID reports. Latencies are in virtual time,
+# measured from the moment the action can be decided (key press, release,
+# or the expiring term) to the first report it produces. Throughput is the
+# number of key events the host processes per second of real time, qmax is
+# the longest time a key event waited in the queue.
+# With --debug compare, every scenario also runs with the debug output enabled
+# (and discarded), to show what it costs per event on the host.
+#
+# Usage, in the `lib' folder:
+#   python -m lemon_keypad_sim.benchmark [--load 0.5] [--polling] [--debug on|compare] [scenario ...]
+
+import time
+
+from . import Simulator, DEFAULT_STEP_COST_US, install
+from .clock import clock
+
+ITERATION_PERIOD_MS = 1000
+FIRST_ITERATION_MS = 100
+# iterations start at different phases, so periodic user tasks are sampled fairly
+PHASE_STEP_MS = 3.7
+PHASE_RANGE_MS = 50
+
+
+class Scenario:
+	def __init__(self, name: str, keymap_factory, trace_factory) -> None:
+		self.name = name
+		self.keymap_factory = keymap_factory  # () -> keymap
+		self.trace_factory = trace_factory  # (t0) -> (key events, trigger time)
+
+
+def _scenarios() -> list:
+	# imported here, lemon_keypad must be imported after the simulator is set up
+	install()
+	from lemon_keypad import CompositeAction as Act, TapDance as TD, KeySequence as KS
+	from lemon_keypad.keycodes import A, B, C, D, E, F
+
+	def keymap(*actions, **layers):
+		keys = list(actions) + [None] * (6 - len(actions))
+		result = {0: keys}
+		for name, layer in layers.items():
+			result[name] = list(layer) + [None] * (6 - len(layer))
+		return result
+
+	return [
+		Scenario(
+			"keycode",
+			lambda: keymap(A),
+			lambda t: ([(t, 0, True), (t + 30, 0, False)], t),
+		),
+		Scenario(
+			"composite_tap",
+			lambda: keymap(Act(B, C)),
+			lambda t: ([(t, 0, True), (t + 50, 0, False)], t + 50),
+		),
+		Scenario(
+			"composite_hold",
+			lambda: keymap(Act(B, C)),
+			lambda t: ([(t, 0, True), (t + 500, 0, False)], t + 200),
+		),
+		Scenario(
+			"composite_long_hold",
+			lambda: keymap(Act(B, C, long_hold=D, hold_term_ms=300, long_hold_start_ms=600)),
+			lambda t: ([(t, 0, True), (t + 800, 0, False)], t + 600),
+		),
+		Scenario(
+			"tap_dance",
+			lambda: keymap(TD(D, E)),
+			lambda t: ([(t, 0, True), (t + 30, 0, False), (t + 60, 0, True), (t + 90, 0, False)], t + 260),
+		),
+		Scenario(
+			"layer_switch",
+			lambda: keymap(Act(layer="L"), L=(None, F)),
+			lambda t: ([(t, 0, True), (t + 50, 1, True), (t + 80, 1, False), (t + 100, 0, False)], t + 50),
+		),
+		Scenario(
+			"key_sequence",
+			lambda: keymap(KS(A, B, C)),
+			lambda t: ([(t, 0, True), (t + 30, 0, False)], t),
+		),
+	]
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+	# nearest-rank percentile of an already sorted list
+	if not sorted_values:
+		return float("nan")
+	rank = max(1, int(fraction * len(sorted_values) + 0.999999))
+	return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _load_task(load: float, period_ms: int = 10):
+	# a user task hogging the CPU for `load' of the time, without yielding
+	import asyncio
+	busy_us = int(period_ms * 1000 * load)
+
+	async def cpu_hog():
+		while True:
+			clock.advance(busy_us)
+			await asyncio.sleep_ms(period_ms - busy_us / 1000)
+
+	return cpu_hog
+
+
+def _discard_log() -> None:
+	import adafruit_logging as logging
+	logger = logging.getLogger("LemonKeypad")
+	if not logger.hasHandlers():
+		logger.addHandler(logging.NullHandler())
+
+
+def run_scenario(scenario: Scenario, *, iterations: int = 100, load: float = 0.0, event_driven: bool = True, step_cost_us: int = DEFAULT_STEP_COST_US, setup=None, debug: bool = False) -> dict:
+	sim = Simulator(step_cost_us=step_cost_us)
+	keypad = sim.keypad
+	keypad.debug = debug
+	if debug:
+		_discard_log()
+	keypad.keymap = scenario.keymap_factory()
+	keypad.event_driven = event_driven
+	if load > 0:
+		keypad.user_tasks = [_load_task(load)]
+	if setup is not None:
+		setup(keypad)
+
+	triggers = []
+	event_count = 0
+	for i in range(iterations):
+		t0 = FIRST_ITERATION_MS + i * ITERATION_PERIOD_MS + (i * PHASE_STEP_MS) % PHASE_RANGE_MS
+		events, trigger = scenario.trace_factory(t0)
+		sim.replay(events)
+		event_count += len(events)
+		triggers.append(trigger)
+
+	end_ms = FIRST_ITERATION_MS + iterations * ITERATION_PERIOD_MS
+	start = time.perf_counter()
+	sim.run(until_ms=end_ms)
+	elapsed = time.perf_counter() - start
+
+	# the first report at or after each trigger, within its iteration
+	latencies = []
+	reports = [t for t, _, _ in sim.reports]
+	index = 0
+	for i, trigger in enumerate(triggers):
+		window_end = FIRST_ITERATION_MS + (i + 1) * ITERATION_PERIOD_MS
+		while index < len(reports) and reports[index] < trigger:
+			index += 1
+		if index < len(reports) and reports[index] < window_end:
+			latencies.append(reports[index] - trigger)
+	latencies.sort()
+
+	return {
+		"name": scenario.name,
+		"samples": len(latencies),
+		"missed": iterations - len(latencies),
+		"p50_ms": percentile(latencies, 0.5),
+		"p99_ms": percentile(latencies, 0.99),
+		"max_ms": latencies[-1] if latencies else float("nan"),
+		"events_per_s": event_count / elapsed if elapsed > 0 else float("inf"),
+		"steps_per_event": sim.loop.steps / event_count,
+		"queue_max_ms": keypad.queue_delay_stats()[2],
+	}
+
+
+def run_benchmarks(names=None, **kwargs) -> list:
+	results = []
+	for scenario in _scenarios():
+		if names and scenario.name not in names:
+			continue
+		results.append(run_scenario(scenario, **kwargs))
+	return results
+
+
+def format_results(results: list) -> str:
+	lines = ["%-20s %7s %6s %8s %8s %8s %9s %10s %10s" % (
+		"scenario", "samples", "missed", "p50(ms)", "p99(ms)", "max(ms)", "qmax(ms)", "events/s", "steps/evt")]
+	for r in results:
+		lines.append("%-20s %7d %6d %8.3f %8.3f %8.3f %9d %10.0f %10.1f" % (
+			r["name"], r["samples"], r["missed"], r["p50_ms"], r["p99_ms"], r["max_ms"],
+			r["queue_max_ms"], r["events_per_s"], r["steps_per_event"]))
+	return "\n".join(lines)
+
+
+def format_debug_comparison(results: list, debug_results: list) -> str:
+	# host time per event, debug output off and on
+	lines = ["%-20s %12s %12s %10s" % ("scenario", "off(us/evt)", "on(us/evt)", "overhead")]
+	for off, on in zip(results, debug_results):
+		off_us = 1e6 / off["events_per_s"]
+		on_us = 1e6 / on["events_per_s"]
+		lines.append("%-20s %12.1f %12.1f %9.0f%%" % (off["name"], off_us, on_us, (on_us / off_us - 1) * 100))
+	return "\n".join(lines)
+
+
+def main(argv=None) -> None:
+	import argparse
+	parser = argparse.ArgumentParser(description="Key event to HID report latency benchmark")
+	parser.add_argument("scenarios", nargs="*", help="scenarios to run, all by default")
+	parser.add_argument("-n", "--iterations", type=int, default=100)
+	parser.add_argument("--load", type=float, default=0.0, help="fraction of CPU time taken by a busy user task")
+	parser.add_argument("--polling", action="store_true", help="use the polling key processer")
+	parser.add_argument("--step-cost-us", type=int, default=DEFAULT_STEP_COST_US, help="virtual CPU time of each task step")
+	parser.add_argument("--debug", choices=("off", "on", "compare"), default="off", help="debug output of the key path")
+	args = parser.parse_args(argv)
+
+	kwargs = dict(
+		names=args.scenarios,
+		iterations=args.iterations,
+		load=args.load,
+		event_driven=not args.polling,
+		step_cost_us=args.step_cost_us,
+	)
+	results = run_benchmarks(debug=args.debug == "on", **kwargs)
+	print(format_results(results))
+	if args.debug == "compare":
+		debug_results = run_benchmarks(debug=True, **kwargs)
+		print()
+		print(format_debug_comparison(results, debug_results))
+
+
+if __name__ == "__main__":
+	main()
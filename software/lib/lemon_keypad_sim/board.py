@@ -0,0 +1,9 @@
+# board module stand-in, pins of a Pico compatible board
+
+from .microcontroller import Pin
+
+for _i in range(29):
+	globals()["GP%d" % _i] = Pin("GP%d" % _i)
+del _i
+
+LED = globals()["GP25"]
@@ -0,0 +1,36 @@
+# Virtual clock shared by all simulated modules
+
+TICKS_PERIOD = 1 << 29
+TICKS_MAX = TICKS_PERIOD - 1
+
+
+class VirtualClock:
+	def __init__(self, start_ticks_ms: int = 0) -> None:
+		self.now_us = 0
+		self.start_ticks_ms = start_ticks_ms
+
+	def reset(self, start_ticks_ms: int = 0) -> None:
+		self.now_us = 0
+		self.start_ticks_ms = start_ticks_ms
+
+	def advance(self, us: int) -> None:
+		if us > 0:
+			self.now_us += us
+
+	def advance_to(self, us: int) -> None:
+		if us > self.now_us:
+			self.now_us = us
+
+	@property
+	def now_ms(self) -> float:
+		return self.now_us / 1000
+
+	def ticks_ms(self) -> int:
+		# same wrap-around behaviour as supervisor.ticks_ms()
+		return self.ticks_ms_at(self.now_us)
+
+	def ticks_ms_at(self, us: int) -> int:
+		return (self.start_ticks_ms + us // 1000) & TICKS_MAX
+
+
+clock = VirtualClock()
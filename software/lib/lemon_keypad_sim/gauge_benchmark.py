@@ -0,0 +1,131 @@
+# Garbage collector load of the level gauge
+#
+# Runs playground.level_gauge in the simulator, with the IMU tilted in a circle,
+# and measures what it leaves to the garbage collector: the collections CPython
+# runs with its threshold set to 1 (about one for each container object
+# allocated and not freed yet), and the peak traced memory. The scheduler and
+# the IMU sampler are included. The same is measured for the gauge as it was
+# before its rewrite around preallocated buffers (allocating_level_gauge below).
+# CPython allocates differently than CircuitPython, compare the rows with each
+# other, not with the device.
+#
+# Usage, in the `lib' folder:
+#   python -m lemon_keypad_sim.gauge_benchmark [--seconds 4]
+
+import gc
+import math
+import tracemalloc
+
+from . import Simulator, install
+from .clock import clock
+
+WARMUP_MS = 1000
+
+
+class CirclingIMU:
+	# accelerometer tilted by 3 m/s^2, turning once every 2 pi seconds
+	gyro = (0.0, 0.0, 0.0)
+
+	@property
+	def acceleration(self) -> tuple:
+		t = clock.now_us / 1_000_000
+		return (3 * math.cos(t), 3 * math.sin(t), 9.8)
+
+
+async def allocating_level_gauge(dev):
+	# the level gauge before its rewrite: new arrays and lists for every IMU sample
+	from ulab import numpy as np
+
+	imu = dev.imu_sampler
+	pixels = dev.animator
+	event_queue = dev.key_scanner.events
+
+	led_positions = np.array([
+		(np.cos((i * 360/pixels.n + 90) / 180 * math.pi), np.sin((i * 360/pixels.n + 90) / 180 * math.pi)) for i in range(pixels.n, 0, -1)
+	])
+	red = np.array((0x40, 0, 0))
+	green = np.array((0, 0x40, 0))
+	blue = np.array((0, 0, 0x40))
+	imu_comp_vector = np.array((0, 0, 0))
+	x_base = 0
+	y_base = 0
+
+	imu.subscribe()
+	try:
+		while True:
+			await imu.wait()
+
+			new_event = event_queue.get()
+			if new_event is not None and new_event.pressed:
+				if new_event.key_number == 0:
+					x_base, y_base, _ = imu_comp_vector + imu.acceleration
+				else:
+					pixels.fill((0, 0, 0))
+					break
+
+			x1, y1, z1 = imu_comp_vector + imu.acceleration
+			platform_vector = np.array((x1-x_base, y1-y_base))
+			length = np.linalg.norm(platform_vector)
+			if length < 0.27:
+				pixels.fill(green.tolist())
+				continue
+			unit_vector = platform_vector / length
+			factors = np.dot(led_positions, unit_vector)
+			factors = np.array([factors]).transpose()
+			colors = factors * red + (1 - factors) * blue
+			for i, color in enumerate(colors.tolist()):
+				pixels[i] = color
+	finally:
+		imu.unsubscribe()
+
+
+def measure(function, seconds: float) -> dict:
+	# runs `function' as the user function of key 1, measured after a warmup
+	import neopixel
+	from microcontroller import Pin
+
+	sim = Simulator()
+	sim.keypad.imu = CirclingIMU()
+	sim.keypad.pixels = neopixel.NeoPixel(Pin("LED"), 6)
+	sim.keypad.keymap = {0: [None, function, None, None, None, None]}
+	sim.tap(1, at_ms=100)
+	sim.run(until_ms=WARMUP_MS)
+
+	gc.collect()
+	collections = sum(s["collections"] for s in gc.get_stats())
+	threshold = gc.get_threshold()
+	tracemalloc.start()
+	gc.set_threshold(1, 10 ** 9, 10 ** 9)
+	try:
+		sim.run(until_ms=WARMUP_MS + seconds * 1000)
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		gc.set_threshold(*threshold)
+		tracemalloc.stop()
+	return {
+		"collections": sum(s["collections"] for s in gc.get_stats()) - collections,
+		"peak_kb": peak / 1024,
+		"shows": sim.keypad.pixels.shows,
+	}
+
+
+def main(argv=None) -> None:
+	import argparse
+	parser = argparse.ArgumentParser(description="Garbage collector load of the level gauge")
+	parser.add_argument("--seconds", type=float, default=4.0, help="virtual time measured")
+	args = parser.parse_args(argv)
+
+	install()
+	from lemon_keypad.playground.level_gauge import level_gauge
+
+	print("%-24s %12s %9s %7s" % ("gauge", "collections", "peak(KB)", "shows"))
+	for name, function in (
+		("level_gauge", level_gauge),
+		("allocating_level_gauge", allocating_level_gauge),
+	):
+		result = measure(function, args.seconds)
+		print("%-24s %12d %9.1f %7d" % (name, result["collections"], result["peak_kb"], result["shows"]))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,21 @@
+# gc module stand-in, adds CircuitPython's heap functions
+#
+# The heap numbers come from tracemalloc, so they are only meaningful while it
+# traces (Simulator(trace_memory=True)), and measure CPython's allocations:
+# compare them with each other, not with the device.
+
+import tracemalloc
+from gc import *  # noqa: F401,F403
+
+# roughly what CircuitPython leaves for the heap on the RP2040
+HEAP_SIZE = 192 * 1024
+
+
+def mem_alloc() -> int:
+	if not tracemalloc.is_tracing():
+		return 0
+	return tracemalloc.get_traced_memory()[0]
+
+
+def mem_free() -> int:
+	return max(0, HEAP_SIZE - mem_alloc())
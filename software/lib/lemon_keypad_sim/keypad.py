@@ -0,0 +1,115 @@
+# keypad module stand-in, events are injected by the simulator
+
+from collections import deque
+
+from .clock import clock
+
+
+class Event:
+	def __init__(self, key_number: int = 0, pressed: bool = True, timestamp: int = None) -> None:
+		self.key_number = key_number
+		self.pressed = pressed
+		self.timestamp = clock.ticks_ms() if timestamp is None else timestamp
+
+	@property
+	def released(self) -> bool:
+		return not self.pressed
+
+	def __eq__(self, other) -> bool:
+		return (self.key_number == other.key_number
+			and self.pressed == other.pressed)
+
+	def __hash__(self) -> int:
+		return self.key_number << 1 | self.pressed
+
+	def __repr__(self) -> str:
+		return "<Event: key_number %d %s>" % (self.key_number, "pressed" if self.pressed else "released")
+
+
+class EventQueue:
+	def __init__(self, max_events: int = 64) -> None:
+		self._events = deque()
+		self._max_events = max_events
+		self.overflowed = False
+
+	def get(self):
+		if self._events:
+			return self._events.popleft()
+		return None
+
+	def get_into(self, event: Event) -> bool:
+		if not self._events:
+			return False
+		src = self._events.popleft()
+		event.key_number = src.key_number
+		event.pressed = src.pressed
+		event.timestamp = src.timestamp
+		return True
+
+	def clear(self) -> None:
+		self._events.clear()
+		self.overflowed = False
+
+	def __len__(self) -> int:
+		return len(self._events)
+
+	def __bool__(self) -> bool:
+		return len(self._events) > 0
+
+	def _sim_put(self, key_number: int, pressed: bool, timestamp: int = None) -> None:
+		if len(self._events) >= self._max_events:
+			self.overflowed = True
+			return
+		self._events.append(Event(key_number, pressed, timestamp))
+
+
+class _Scanner:
+	def __init__(self, key_count: int, max_events: int) -> None:
+		self.key_count = key_count
+		self.events = EventQueue(max_events)
+		self._pressed = bytearray(key_count)
+
+	def reset(self) -> None:
+		self.events.clear()
+
+	def deinit(self) -> None:
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args) -> None:
+		self.deinit()
+
+	def _sim_event(self, key_number: int, pressed: bool, timestamp: int = None) -> None:
+		# like the real scanner, only state changes produce events
+		if bool(self._pressed[key_number]) == pressed:
+			return
+		self._pressed[key_number] = pressed
+		self.events._sim_put(key_number, pressed, timestamp)
+
+
+class Keys(_Scanner):
+	def __init__(self, pins, *, value_when_pressed: bool, pull: bool = True, interval: float = 0.02, max_events: int = 64, debounce_threshold: int = 1) -> None:
+		super().__init__(len(pins), max_events)
+		self.pins = tuple(pins)
+
+
+class KeyMatrix(_Scanner):
+	def __init__(self, row_pins, column_pins, columns_to_anodes: bool = True, interval: float = 0.02, max_events: int = 64, debounce_threshold: int = 1) -> None:
+		super().__init__(len(row_pins) * len(column_pins), max_events)
+		self.row_count = len(row_pins)
+		self.column_count = len(column_pins)
+
+	def key_number_to_row_column(self, key_number: int):
+		return divmod(key_number, self.column_count)
+
+	def row_column_to_key_number(self, row: int, column: int) -> int:
+		return row * self.column_count + column
+
+
+class ShiftRegisterKeys(_Scanner):
+	def __init__(self, *, clock, data, latch, value_to_latch: bool = True, key_count, value_when_pressed: bool, interval: float = 0.02, max_events: int = 64, debounce_threshold: int = 1) -> None:
+		if not isinstance(key_count, int):
+			key_count = sum(key_count)
+		super().__init__(key_count, max_events)
@@ -0,0 +1,175 @@
+# A LSM6DS3TR-C on a simulated I2C bus
+#
+# Stands in for an adafruit_bus_device I2CDevice of the sensor. Its FIFO replays
+# a recorded dump: data sets (gyro x, y, z, accelerometer x, y, z, raw int16 words)
+# are queued at the configured data rate as the virtual clock advances. The
+# output registers show the data set of the dump due at the sensor's data rate.
+# Bus time is charged to the virtual clock, 400 kHz by default.
+#
+# Example:
+#   device = FakeLSM6DS(make_fifo_dump([(100, 0, -50, 0, 0, 8192)] * 1000))
+#   imu = LSM6DSFIFO(device)
+
+import struct
+
+from .clock import clock
+
+_CTRL1_XL = 0x10
+_CTRL2_G = 0x11
+_CTRL3_C = 0x12
+_FIFO_CTRL5 = 0x0A
+_OUTX_L_G = 0x22
+_FIFO_STATUS1 = 0x3A
+_FIFO_DATA_OUT_L = 0x3E
+_FIFO_DATA_OUT_H = 0x3F
+
+_FIFO_WORDS = 2048  # 4 KB
+_SET_WORDS = 6
+_ODR_HZ = (0, 12.5, 26, 52, 104, 208, 416, 833, 1666, 3332, 6664)
+
+
+def make_fifo_dump(samples) -> bytes:
+	# samples: iterable of raw (gx, gy, gz, ax, ay, az) int16 values
+	return b"".join(struct.pack("<6h", *sample) for sample in samples)
+
+
+def load_fifo_dump(path: str) -> bytes:
+	# a dump recorded from FIFO_DATA_OUT, starting at a data set
+	with open(path, "rb") as f:
+		return f.read()
+
+
+class FakeLSM6DS:
+	def __init__(self, dump: bytes = b"", *, accel_ctrl: int = 0x48, gyro_ctrl: int = 0x40,
+			bus_hz: int = 400_000, repeat: bool = True) -> None:
+		# the default control values are what the adafruit_lsm6ds driver sets: 104 Hz, 4 g, 250 dps
+		self.registers = bytearray(0x80)
+		self.registers[_CTRL1_XL] = accel_ctrl
+		self.registers[_CTRL2_G] = gyro_ctrl
+		self.registers[_CTRL3_C] = 0x04  # IF_INC
+		self.dump = memoryview(dump).cast("h") if dump else memoryview(b"").cast("h")
+		self.repeat = repeat
+		self.bus_hz = bus_hz
+
+		self.fifo = []  # queued words
+		self.dump_index = 0  # next word of the dump to queue
+		self.pattern = 0  # position in a data set of the next word to read
+		self.over_run = False
+		self.queued_until_us = 0
+
+		# bus statistics
+		self.transactions = 0
+		self.bytes_transferred = 0
+
+	### Sensor ###
+
+	@property
+	def rate_hz(self) -> float:
+		mode = self.registers[_FIFO_CTRL5]
+		if mode & 0x07 == 0:
+			return 0
+		return _ODR_HZ[(mode >> 3) & 0x0F]
+
+	def _update_fifo(self) -> None:
+		# queue the data sets taken since the last update
+		rate = self.rate_hz
+		if rate == 0:
+			self.queued_until_us = clock.now_us
+			return
+		interval_us = 1_000_000 / rate
+		dump = self.dump
+		while self.queued_until_us + interval_us <= clock.now_us:
+			self.queued_until_us += interval_us
+			if len(dump) < _SET_WORDS:
+				continue
+			if self.dump_index + _SET_WORDS > len(dump):
+				if not self.repeat:
+					continue
+				self.dump_index = 0
+			self.fifo.extend(dump[self.dump_index:self.dump_index + _SET_WORDS])
+			self.dump_index += _SET_WORDS
+			if len(self.fifo) > _FIFO_WORDS:
+				# continuous mode overwrites the oldest data set
+				del self.fifo[:_SET_WORDS]
+				self.over_run = True
+
+	def _output_word(self, index: int) -> int:
+		# word `index' of the newest data set, the sensor samples whether the FIFO runs or not
+		odr = min(self.registers[_CTRL1_XL] >> 4, self.registers[_CTRL2_G] >> 4)
+		sets = len(self.dump) // _SET_WORDS
+		if odr == 0 or sets == 0:
+			return 0
+		n = int(clock.now_us * _ODR_HZ[odr] / 1_000_000)
+		n = n % sets if self.repeat else min(n, sets - 1)
+		return self.dump[n * _SET_WORDS + index]
+
+	def _write_register(self, register: int, value: int) -> None:
+		if register == _FIFO_CTRL5:
+			self._update_fifo()
+			if value & 0x07 == 0:
+				# bypass mode empties the FIFO
+				self.fifo.clear()
+				self.pattern = 0
+				self.over_run = False
+			self.queued_until_us = clock.now_us
+		self.registers[register] = value
+
+	def _read(self, register: int, buf, start: int, end: int) -> None:
+		self._update_fifo()
+		fifo = self.fifo
+		for i in range(start, end):
+			if register == _FIFO_STATUS1:
+				buf[i] = len(fifo) & 0xFF
+			elif register == _FIFO_STATUS1 + 1:
+				buf[i] = ((len(fifo) >> 8) & 0x07) | (0x40 if self.over_run else 0) | (0x10 if not fifo else 0)
+				self.over_run = False
+			elif register == _FIFO_STATUS1 + 2:
+				buf[i] = self.pattern & 0xFF
+			elif register == _FIFO_STATUS1 + 3:
+				buf[i] = self.pattern >> 8
+			elif register in (_FIFO_DATA_OUT_L, _FIFO_DATA_OUT_H):
+				word = fifo[0] if fifo else 0
+				buf[i] = word & 0xFF if register == _FIFO_DATA_OUT_L else (word >> 8) & 0xFF
+				if register == _FIFO_DATA_OUT_H:
+					if fifo:
+						del fifo[0]
+						self.pattern = (self.pattern + 1) % _SET_WORDS
+					register = _FIFO_DATA_OUT_L - 1  # rolls back
+			elif _OUTX_L_G <= register < _OUTX_L_G + 2 * _SET_WORDS:
+				word = self._output_word((register - _OUTX_L_G) // 2) & 0xFFFF
+				buf[i] = word & 0xFF if (register - _OUTX_L_G) % 2 == 0 else word >> 8
+			else:
+				buf[i] = self.registers[register]
+			if self.registers[_CTRL3_C] & 0x04:
+				register += 1
+
+	def _charge_bus(self, nbytes: int) -> None:
+		# address byte included, 9 clocks per byte
+		self.transactions += 1
+		self.bytes_transferred += nbytes
+		clock.advance((nbytes + 1) * 9 * 1_000_000 // self.bus_hz)
+
+	### I2CDevice interface ###
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+		pass
+
+	def write(self, buf, *, start: int = 0, end=None) -> None:
+		if end is None:
+			end = len(buf)
+		self._charge_bus(end - start)
+		register = buf[start]
+		for value in buf[start + 1:end]:
+			self._write_register(register, value)
+			register += 1
+
+	def write_then_readinto(self, out_buffer, in_buffer, *, out_start: int = 0, out_end=None, in_start: int = 0, in_end=None) -> None:
+		if out_end is None:
+			out_end = len(out_buffer)
+		if in_end is None:
+			in_end = len(in_buffer)
+		self._charge_bus(out_end - out_start + 1 + in_end - in_start)
+		self._read(out_buffer[out_start], in_buffer, in_start, in_end)
@@ -0,0 +1,41 @@
+# microcontroller module stand-in
+
+
+class Pin:
+	def __init__(self, name) -> None:
+		self.name = name
+
+	def __repr__(self) -> str:
+		return "board.%s" % (self.name,)
+
+
+class WatchDogTimer:
+	def __init__(self) -> None:
+		self.timeout = 0
+		self.mode = None
+		self.feeds = 0
+
+	def feed(self) -> None:
+		self.feeds += 1
+
+	def deinit(self) -> None:
+		self.mode = None
+
+
+class RunMode:
+	NORMAL = "NORMAL"
+	SAFE_MODE = "SAFE_MODE"
+	BOOTLOADER = "BOOTLOADER"
+	UF2 = "UF2"
+
+
+watchdog = WatchDogTimer()
+nvm = bytearray(4096)
+
+
+def on_next_reset(run_mode) -> None:
+	pass
+
+
+def reset() -> None:
+	raise SystemExit("microcontroller.reset()")
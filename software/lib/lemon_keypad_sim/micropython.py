@@ -0,0 +1,20 @@
+# micropython module stand-in
+
+
+def const(value):
+	return value
+
+
+def native(func):
+	return func
+
+
+viper = native
+
+
+def opt_level(level=None):
+	return 0
+
+
+def mem_info(verbose=None):
+	pass
@@ -0,0 +1,49 @@
+# neopixel module stand-in, counts the frames really sent to the LEDs
+
+RGB = "RGB"
+GRB = "GRB"
+RGBW = "RGBW"
+GRBW = "GRBW"
+
+
+class NeoPixel:
+	def __init__(self, pin, n: int, *, bpp: int = 3, brightness: float = 1.0, auto_write: bool = True, pixel_order=None) -> None:
+		self.pin = pin
+		self.n = n
+		self.bpp = bpp
+		self.brightness = brightness
+		self.auto_write = auto_write
+		self.pixel_order = pixel_order
+		self._pixels = [(0, 0, 0)] * n
+		self.shows = 0
+
+	def __len__(self) -> int:
+		return self.n
+
+	def __getitem__(self, index):
+		return self._pixels[index]
+
+	def __setitem__(self, index, value) -> None:
+		if isinstance(index, slice):
+			self._pixels[index] = [tuple(int(c) for c in v) for v in value]
+		else:
+			if isinstance(value, int):
+				value = (value >> 16 & 0xFF, value >> 8 & 0xFF, value & 0xFF)
+			self._pixels[index] = tuple(int(c) for c in value)
+		if self.auto_write:
+			self.show()
+
+	def fill(self, color) -> None:
+		auto_write = self.auto_write
+		self.auto_write = False
+		for i in range(self.n):
+			self[i] = color
+		self.auto_write = auto_write
+		if auto_write:
+			self.show()
+
+	def show(self) -> None:
+		self.shows += 1
+
+	def deinit(self) -> None:
+		pass
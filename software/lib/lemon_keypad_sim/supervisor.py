@@ -0,0 +1,25 @@
+# supervisor module stand-in
+
+from .clock import clock
+
+
+class Runtime:
+	def __init__(self) -> None:
+		self.usb_connected = True
+		self.serial_connected = True
+		self.serial_bytes_available = 0
+
+
+runtime = Runtime()
+
+
+def ticks_ms() -> int:
+	return clock.ticks_ms()
+
+
+def set_usb_identification(manufacturer=None, product=None, vid=None, pid=None) -> None:
+	pass
+
+
+def reload() -> None:
+	pass
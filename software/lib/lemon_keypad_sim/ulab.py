@@ -0,0 +1,6 @@
+# ulab stand-in, backed by numpy
+#
+# ulab.numpy follows the numpy API closely enough for lemon_keypad,
+# the simulator only provides it when numpy is installed.
+
+import numpy
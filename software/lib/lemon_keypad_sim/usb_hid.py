@@ -0,0 +1,69 @@
+# usb_hid module stand-in, every sent report is captured in `reports'
+
+from .clock import clock
+
+# (virtual time in us, device name, report bytes)
+reports = []
+
+
+class Device:
+	def __init__(self, *, report_descriptor=b"", usage_page: int, usage: int, report_ids=(0,), in_report_lengths=(0,), out_report_lengths=(0,), name: str = None) -> None:
+		self.usage_page = usage_page
+		self.usage = usage
+		# like on the device, the descriptor, report ids and lengths can't be read back
+		self.name = name if name is not None else "hid_%02x_%02x" % (usage_page, usage)
+		self.last_received_report = None
+
+	def _copy(self):
+		# enable() keeps copies of the devices, like CircuitPython does
+		return Device(usage_page=self.usage_page, usage=self.usage, name=self.name)
+
+	def send_report(self, report, report_id: int = None) -> None:
+		reports.append((clock.now_us, self.name, bytes(report)))
+
+	def get_last_received_report(self, report_id: int = None):
+		report = self.last_received_report
+		self.last_received_report = None
+		return report
+
+	def __repr__(self) -> str:
+		return "<Device %s>" % (self.name,)
+
+
+Device.KEYBOARD = Device(usage_page=0x01, usage=0x06, report_ids=(1,), in_report_lengths=(8,), out_report_lengths=(1,), name="keyboard")
+Device.BOOT_KEYBOARD = Device.KEYBOARD
+Device.MOUSE = Device(usage_page=0x01, usage=0x02, report_ids=(2,), in_report_lengths=(4,), out_report_lengths=(0,), name="mouse")
+Device.BOOT_MOUSE = Device.MOUSE
+Device.CONSUMER_CONTROL = Device(usage_page=0x0C, usage=0x01, report_ids=(3,), in_report_lengths=(2,), out_report_lengths=(0,), name="consumer")
+
+devices = tuple(dev._copy() for dev in (Device.KEYBOARD, Device.MOUSE, Device.CONSUMER_CONTROL))
+_boot_device = 0  # boot device offered by enable()
+_host_boot_device = 0  # boot device the host asked for
+
+
+def enable(new_devices, boot_device: int = 0) -> None:
+	global devices, _boot_device
+	devices = tuple(dev._copy() for dev in new_devices)
+	_boot_device = boot_device
+
+
+def disable() -> None:
+	enable(())
+
+
+def get_boot_device() -> int:
+	return _host_boot_device
+
+
+def set_host_boot_protocol(enabled: bool) -> None:
+	# simulate a host using the boot protocol, e.g. BIOS
+	global _host_boot_device
+	_host_boot_device = _boot_device if enabled else 0
+
+
+def set_interface_name(name: str) -> None:
+	pass
+
+
+def clear_reports() -> None:
+	reports.clear()
@@ -0,0 +1,10 @@
+# watchdog module stand-in
+
+
+class WatchDogMode:
+	RAISE = "RAISE"
+	RESET = "RESET"
+
+
+class WatchDogTimeout(Exception):
+	pass
@@ -15,14 +15,40 @@ if [[ -n "$2" ]]; then
     DIST_LANGUAGE="$2"
 fi
 
+# lemon_keypad is shipped as .mpy bytecode, so the device doesn't compile it at every boot
+# use the mpy-cross of the CircuitPython major version on the device, set LEMON_MPY=0 to ship the sources
+MPY_CROSS="${MPY_CROSS:-mpy-cross}"
+LEMON_MPY="${LEMON_MPY:-1}"
+
 # CPY_REQUIREMENTS=$(awk '/^[a-z].*/ { printf "%s ", $0 }' "$CODE_DIR/requirements-circuitpython.txt")
 [ -d "$TARGET_DIR" ] || mkdir -p "$TARGET_DIR"
 
 printf "Copy code files\n"
 for f in boot.py code.py safemode.py settings.toml lib requirements-circuitpython.txt; do
-    rsync -r "$CODE_DIR/$f" "$TARGET_DIR/"
+    rsync -r --exclude 'lemon_keypad_sim/' --exclude '__pycache__/' "$CODE_DIR/$f" "$TARGET_DIR/"
 done
 
+LIB_DIR="$TARGET_DIR/lib/lemon_keypad"
+if [[ "$LEMON_MPY" != "0" ]]; then
+    printf "Compile lemon_keypad with %s\n" "$("$MPY_CROSS" --version)"
+    REPORT=$(mktemp)
+    printf "%-40s %8s %8s\n" "module" "py" "mpy" > "$REPORT"
+    # keycode_helper.py is where users look keycodes up, it stays readable
+    while IFS= read -r -d '' src; do
+        mpy="${src%.py}.mpy"
+        "$MPY_CROSS" -o "$mpy" -s "${src#"$TARGET_DIR/lib/"}" "$src"
+        printf "%-40s %8d %8d\n" "${src#"$LIB_DIR/"}" "$(stat -c %s "$src")" "$(stat -c %s "$mpy")" >> "$REPORT"
+        rm "$src"
+    done < <(find "$LIB_DIR" -name '*.py' ! -name keycode_helper.py -print0 | sort -z)
+    awk 'NR > 1 { py += $2; mpy += $3 } END { printf "%-40s %8d %8d\n", "total", py, mpy }' "$REPORT" >> "$REPORT"
+    cat "$REPORT"
+    rm "$REPORT"
+else
+    # left over from a previous .mpy build
+    find "$LIB_DIR" -name '*.mpy' -delete
+fi
+cp "$SCRIPT_DIR/import_profile.py" "$TARGET_DIR/"
+
 printf "Install requirements\n"
 if [ -f "$BOOT_OUT_FILE" ]; then
     circup --path "$TARGET_DIR" --timeout 10 install -r "$REQUIREMENTS_FILE"
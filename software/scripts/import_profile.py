@@ -0,0 +1,59 @@
+# Import time and heap use of lemon_keypad, run on the device
+#
+# distribute.sh copies this next to code.py. Run it from the REPL right after a
+# reset (modules imported before aren't imported again):
+#   import import_profile
+# Run it once on a .mpy build and once on a .py build (LEMON_MPY=0) to compare
+# them. "allocated" includes what compiling the sources needed, "kept" is what
+# stays on the heap after a collection.
+
+import gc
+import os
+import sys
+from time import monotonic_ns
+
+MODULES = (
+	"lemon_keypad",
+	"lemon_keypad.keycodes",
+	"lemon_keypad.keycode_helper",
+	"lemon_keypad.imu",
+	"lemon_keypad.animation",
+	"lemon_keypad.memstats",
+	"lemon_keypad.playground",
+)
+
+
+def build_kind(path: str = "/lib/lemon_keypad") -> str:
+	files = os.listdir(path)
+	mpy = sum(1 for f in files if f.endswith(".mpy"))
+	py = sum(1 for f in files if f.endswith(".py"))
+	if mpy and py:
+		return "mixed (%d .mpy, %d .py)" % (mpy, py)
+	return ".mpy" if mpy else ".py"
+
+
+def profile(modules=MODULES) -> None:
+	print("lemon_keypad build: %s, CircuitPython %s" % (build_kind(), ".".join(str(v) for v in sys.implementation.version)))
+	print("%-28s %9s %10s %10s" % ("module", "time ms", "allocated", "kept"))
+	total_ms = 0.0
+	total_kept = 0
+	for name in modules:
+		if name in sys.modules:
+			print("%-28s already imported" % name)
+			continue
+		gc.collect()
+		free = gc.mem_free()
+		start = monotonic_ns()
+		__import__(name)
+		elapsed_ms = (monotonic_ns() - start) / 1_000_000
+		allocated = free - gc.mem_free()
+		gc.collect()
+		kept = free - gc.mem_free()
+		total_ms += elapsed_ms
+		total_kept += kept
+		print("%-28s %9.1f %10d %10d" % (name, elapsed_ms, allocated, kept))
+	print("%-28s %9.1f %10s %10d" % ("total", total_ms, "", total_kept))
+	print("%d bytes free" % gc.mem_free())
+
+
+profile()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# Keycode table generator, runs on the host
+#
+#   scripts/keycode_table.py
+#       regenerates lib/lemon_keypad/keycodes.py from keycode_helper.py,
+#       run it after adding keys to keycode_helper.py
+#   scripts/keycode_table.py --imports code.py [keymap.py ...]
+#       prints the keycodes import for the names the files use, to replace
+#       `from lemon_keypad.keycode_helper import *`
+#
+# keycode_helper is loaded in the host simulator, pip install
+# adafruit-circuitpython-hid adafruit-circuitpython-logging first.
+
+import argparse
+import keyword
+import os
+import re
+import sys
+import textwrap
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LIB_DIR = os.path.join(SCRIPT_DIR, "..", "lib")
+OUTPUT = os.path.join(LIB_DIR, "lemon_keypad", "keycodes.py")
+sys.path.insert(0, os.path.abspath(LIB_DIR))
+
+HEADER = '''\
+# Generated by scripts/keycode_table.py from keycode_helper.py, don't edit
+#
+# The keycodes of keycode_helper as a few byte strings, looked up by name when
+# they are imported:
+#   from lemon_keypad.keycodes import A, LEFT_CONTROL, C_MUTE, TRNS
+# binds only the listed names, instead of one module global per keycode in
+# keycode_helper and another one in the keymap for each of them with a star
+# import. A star import of this module imports nothing, use keycode_helper
+# for that.
+
+from lemon_keypad import ConsumerCode, MouseCode, TRANSPARENT
+
+'''
+
+FOOTER = '''
+
+def _find(names: bytes, codes: bytes, key: bytes) -> int:
+	i = names.find(key)
+	if i < 0:
+		return -1
+	return codes[names.count(b" ", 0, i)]
+
+
+def code(name: str):
+	# the keycode called name in keycode_helper
+	if " " not in name:
+		key = b" " + name.encode() + b" "
+		value = _find(_KEY_NAMES, _KEY_CODES, key)
+		if value >= 0:
+			return value
+		value = _find(_CONSUMER_NAMES, _CONSUMER_CODES, key)
+		if value >= 0:
+			return ConsumerCode(value)
+		value = _find(_MOUSE_NAMES, _MOUSE_CODES, key)
+		if value >= 0:
+			return MouseCode(value)
+	if name == "TRNS":
+		return TRANSPARENT
+	raise AttributeError("No keycode named %s" % name)
+
+
+def __getattr__(name: str):
+	return code(name)
+'''
+
+
+def load_keycodes():
+	# (name, value) of keycode_helper, in definition order
+	import lemon_keypad_sim
+	lemon_keypad_sim.install()
+	import lemon_keypad
+	from lemon_keypad import keycode_helper
+
+	helper_names = {"CC", "MS", "TRANSPARENT", "const"}
+	return [
+		(name, value) for name, value in vars(keycode_helper).items()
+		if not name.startswith("_") and name not in helper_names
+		and (isinstance(value, int) or value is lemon_keypad.TRANSPARENT)
+	]
+
+
+def table(names) -> str:
+	# names as one space separated byte string, also at both ends
+	lines = textwrap.wrap(" ".join(names), 72, break_long_words=False)
+	return "\n".join('\tb"%s%s "' % (" " if i == 0 else "", line) for i, line in enumerate(lines))
+
+
+def codes(values) -> str:
+	values = list(values)
+	for value in values:
+		if not 0 <= value <= 0xFF:
+			raise ValueError("Keycode 0x%X doesn't fit in a byte" % value)
+	return "\n".join(
+		'\tb"%s"' % "".join("\\x%02x" % v for v in values[i:i + 16])
+		for i in range(0, len(values), 16)
+	)
+
+
+def generate() -> None:
+	keycodes = load_keycodes()
+	import lemon_keypad
+	groups = (
+		("KEY", "keyboard keys", [(n, v) for n, v in keycodes if type(v) is int]),
+		("CONSUMER", "consumer control keys", [(n, v) for n, v in keycodes if isinstance(v, lemon_keypad.ConsumerCode)]),
+		("MOUSE", "mouse buttons", [(n, v) for n, v in keycodes if isinstance(v, lemon_keypad.MouseCode)]),
+	)
+	lines = [HEADER.rstrip("\n")]
+	for prefix, title, entries in groups:
+		lines.append("")
+		lines.append("# %s, names and the keycodes in the same order" % title)
+		lines.append("_%s_NAMES = (" % prefix)
+		lines.append(table(n for n, _ in entries))
+		lines.append(")")
+		lines.append("_%s_CODES = (" % prefix)
+		lines.append(codes(v for _, v in entries))
+		lines.append(")")
+	with open(OUTPUT, "w", encoding="utf-8") as f:
+		f.write("\n".join(lines) + "\n" + FOOTER)
+	print("%d keycodes written to %s" % (sum(len(g[2]) for g in groups), os.path.relpath(OUTPUT)))
+
+
+def print_imports(paths) -> None:
+	known = {name for name, _ in load_keycodes()}
+	used = []
+	for path in paths:
+		with open(path, encoding="utf-8") as f:
+			# comments and strings may mention keys too, drop them first
+			source = re.sub(r"#.*|'[^'\n]*'|\"[^\"\n]*\"", "", f.read())
+		for name in re.findall(r"\b[A-Za-z_][A-Za-z0-9_]*\b", source):
+			if name in known and name not in used and not keyword.iskeyword(name):
+				used.append(name)
+	if not used:
+		print("# no keycodes used")
+		return
+	print("\n".join(textwrap.wrap(
+		", ".join(used) + ",", 96,
+		initial_indent="    ", subsequent_indent="    ",
+	)).join(("from lemon_keypad.keycodes import (\n", "\n)")))
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Generate the keycode table, or the keycodes import of keymaps")
+	parser.add_argument("--imports", nargs="+", metavar="FILE", help="keymap files to print the import for")
+	args = parser.parse_args()
+	if args.imports:
+		print_imports(args.imports)
+	else:
+		generate()
+
+
+if __name__ == "__main__":
+	main()
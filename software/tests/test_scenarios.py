@@ -0,0 +1,190 @@
+# Key handling scenarios replayed in the host simulator
+#
+# Run from the `software' folder, with the simulator's requirements installed:
+#   pytest tests
+# The simulator replaces asyncio and gc for the whole process, see lemon_keypad_sim.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from lemon_keypad_sim import Simulator, install
+
+# lemon_keypad can only be imported once the simulator is installed
+install()
+import asyncio
+from lemon_keypad import CompositeAction as Act, TapDance as TD, KeySequence as KS, KeyCombination as KC
+from lemon_keypad.keycodes import A, B, C, D, E, LEFT_CONTROL, TRNS
+
+
+def run(keymap, trace, until_ms=10_000):
+	# trace: (time in ms, key number, pressed)
+	sim = Simulator()
+	sim.keypad.keymap = keymap
+	sim.replay(trace)
+	sim.run(until_ms)
+	return sim
+
+
+def keys(sim) -> list:
+	# (modifiers, keycodes) held after each keyboard report, repeated reports left out
+	held = []
+	for _, report in sim.device_reports("keyboard"):
+		state = (report[0], tuple(k for k in report[2:] if k))
+		if not held or held[-1] != state:
+			held.append(state)
+	return held
+
+
+def tap(key: int, at_ms: int, hold_ms: int = 30) -> list:
+	return [(at_ms, key, True), (at_ms + hold_ms, key, False)]
+
+
+### CompositeAction ###
+
+HOLD_TAP = {0: [Act(A, B, long_hold=C), None, None, None, None, None]}
+
+
+def test_composite_tap():
+	sim = run(HOLD_TAP, tap(0, 10))
+	assert keys(sim) == [(0, (A,)), (0, ())]
+
+
+def test_composite_hold():
+	sim = run(HOLD_TAP, tap(0, 10, hold_ms=1000))
+	assert keys(sim) == [(0, (B,)), (0, ())]
+
+
+def test_composite_long_hold():
+	# fires once the key is held past long_hold_start_ms, released with the key
+	sim = run(HOLD_TAP, tap(0, 10, hold_ms=6000))
+	reports = sim.device_reports("keyboard")
+	assert keys(sim) == [(0, (C,)), (0, ())]
+	pressed_at = [t for t, report in reports if report[2] == C][0]
+	assert 5010 <= pressed_at < 5012
+
+
+def test_composite_hold_with_another_key():
+	# another key pressed while undecided triggers the hold action first
+	keymap = {0: [Act(A, LEFT_CONTROL), D, None, None, None, None]}
+	sim = run(keymap, [(10, 0, True), (60, 1, True), (80, 1, False), (100, 0, False)])
+	assert keys(sim) == [(0x01, (D,)), (0x01, ()), (0, ())]
+
+
+def test_two_composite_keys_pending():
+	# without layers, both keys stay pending and are decided in press order
+	keymap = {0: [Act(A, B), Act(C, D), None, None, None, None]}
+	sim = run(keymap, [(10, 0, True), (20, 1, True), (50, 0, False), (80, 1, False)])
+	assert keys(sim) == [(0, (A,)), (0, ()), (0, (C,)), (0, ())]
+
+
+def test_user_function_forgets_pending_keys():
+	# the release of key 1 is dropped while the function runs, it isn't pending anymore
+	async def function(keypad):
+		await asyncio.sleep(0.1)
+
+	keymap = {0: [Act(function, D), Act(B, C), None, None, None, None]}
+	trace = [(10, 0, True), (20, 1, True), (50, 0, False), (80, 1, False)]
+	for again_ms in (160, 400):
+		sim = run(keymap, trace + tap(1, again_ms))
+		assert keys(sim)[-2:] == [(0, (B,)), (0, ())]
+
+
+### TapDance ###
+
+TAP_DANCE = {0: [TD(A, B, C), E, None, None, None, None]}
+
+
+def test_tap_dance_taps():
+	sim = run(TAP_DANCE, tap(0, 10) + tap(0, 100))
+	assert keys(sim) == [(0, (B,)), (0, ())]
+
+
+def test_tap_dance_held():
+	# the last tap is held, its action is released with the key
+	sim = run(TAP_DANCE, tap(0, 10) + tap(0, 100, hold_ms=500))
+	reports = sim.device_reports("keyboard")
+	assert keys(sim) == [(0, (B,)), (0, ())]
+	assert reports[-1][0] >= 600
+
+
+def test_tap_dance_interrupted():
+	# another key ends the TapDance, its action goes first
+	sim = run(TAP_DANCE, tap(0, 10) + tap(1, 60))
+	assert keys(sim) == [(0, (A,)), (0, (E,)), (0, ())]
+
+
+def test_tap_dance_limit():
+	# a tap past the last action triggers it right away
+	sim = run(TAP_DANCE, tap(0, 10) + tap(0, 100) + tap(0, 190) + tap(0, 280))
+	assert keys(sim) == [(0, (C,)), (0, ())]
+	assert sim.device_reports("keyboard")[0][0] < 281
+
+
+### Layers ###
+
+LAYERS = {
+	0: [Act(layer="M"), Act(layer="L"), D, None, None, None],
+	"M": [TRNS, TRNS, B],
+	"L": [TRNS, TRNS, C],
+}
+# layer keys are held past tap_term_ms before the next key
+S = 1000
+
+
+def layer_keys(trace) -> list:
+	# the keys typed by key 2, the layer keys are released before the last tap
+	sim = run(LAYERS, trace + [(8 * S, 0, False), (8 * S, 1, False)] + tap(2, 9 * S))
+	return [k for _, k in keys(sim) if k]
+
+
+def test_layer_hold():
+	assert layer_keys([(10, 0, True)] + tap(2, S)) == [(B,), (D,)]
+
+
+def test_last_activated_layer_wins():
+	assert layer_keys([(10, 0, True), (S, 1, True)] + tap(2, 2 * S)) == [(C,), (D,)]
+	assert layer_keys([(10, 1, True), (S, 0, True)] + tap(2, 2 * S)) == [(B,), (D,)]
+
+
+def test_layer_released_below_top():
+	# releasing the layer below keeps the top one, releasing that goes back to the base layer
+	trace = [(10, 0, True), (S, 1, True), (2 * S, 0, False)] + tap(2, 3 * S) + [(4 * S, 1, False)] + tap(2, 5 * S)
+	assert layer_keys(trace) == [(C,), (D,), (D,)]
+	trace = [(10, 1, True), (S, 0, True), (2 * S, 0, False)] + tap(2, 3 * S)
+	assert layer_keys(trace) == [(C,), (D,)]
+
+
+def test_transparent_key():
+	# TRNS in the top layer falls through to the next active layer below
+	keymap = {
+		0: [Act(layer=1), Act(layer=2), C, D, E, None],
+		1: [TRNS, TRNS, A],
+		2: [TRNS, TRNS, TRNS, B],
+	}
+	trace = [(0, 0, True), (10, 1, True)] + tap(2, 300) + tap(3, 400) + tap(4, 500) + [(600, 1, False)] + tap(3, 700)
+	sim = run(keymap, trace)
+	assert [k for _, k in keys(sim) if k] == [(A,), (B,), (E,), (D,)]
+
+
+### Macros ###
+
+def test_key_sequence():
+	keymap = {0: [KS(A, KS(B, C), D), None, None, None, None, None]}
+	sim = run(keymap, tap(0, 10))
+	assert [k for _, k in keys(sim) if k] == [(A,), (B,), (C,), (D,)]
+
+
+def test_key_combination():
+	# all keys are pressed together, then released together
+	keymap = {0: [KC(LEFT_CONTROL, A, B), None, None, None, None, None]}
+	sim = run(keymap, tap(0, 10))
+	assert keys(sim) == [(0x01, (A, B)), (0, ())]
+
+
+def test_text_in_sequence():
+	# the keys after a string wait for it
+	keymap = {0: [KS("ab", E), None, None, None, None, None]}
+	sim = run(keymap, tap(0, 10))
+	assert [k for _, k in keys(sim) if k] == [(A,), (B,), (E,)]